@@ -1,23 +1,129 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 import os
 from dotenv import load_dotenv
+from app.utils.journal import JournalStore
+from app.utils import metrics
+from app.utils.query import (
+    apply_update, compile_query, index_lookups, normalize_sort, project,
+    sort_documents, upsert_document,
+)
+import itertools
+import threading
+import time
 
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "krishi")
 
+# Connection pool sizing; size MAX_POOL_SIZE to the number of concurrent
+# requests one worker should run against MongoDB.
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+# Indexes created (idempotently) at startup: collection -> [(field, unique)]
+COLLECTION_INDEXES = {
+    "users": [("username", True), ("email", True)],
+    "products": [("id", True), ("category", False)],
+    "orders": [("buyer_id", False)],
+    "stock": [("id", True)],
+    "reservations": [("expires_at", False)],
+}
+
+# Storage backend: "mongo" (falls back to FALLBACK_DATABASE_BACKEND when
+# MongoDB is unreachable), or a local store: "sqlite" or "json"
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "mongo").lower()
+FALLBACK_DATABASE_BACKEND = os.getenv("FALLBACK_DATABASE_BACKEND", "json").lower()
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "krishi.db")
+
+# Fallback (no MongoDB) storage: snapshot file plus append-only journal
+MOCK_DB_PATH = os.getenv("MOCK_DB_PATH", "mock_users.json")
+MOCK_DB_FSYNC_INTERVAL_MS = int(os.getenv("MOCK_DB_FSYNC_INTERVAL_MS", "50"))
+MOCK_DB_COMPACT_EVERY = int(os.getenv("MOCK_DB_COMPACT_EVERY", "10000"))
+# How often (seconds) get_database() stats the files for external changes
+MOCK_DB_RELOAD_CHECK_SECONDS = float(os.getenv("MOCK_DB_RELOAD_CHECK_SECONDS", "1.0"))
+
 client: AsyncIOMotorClient = None
 database = None
+_mock_database = None
+_local_database_lock = threading.Lock()
+_sqlite_database = None
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Publishes checkout latency and connection counts to app.utils.metrics"""
+    def __init__(self):
+        # Motor checks a connection out on the worker thread running the op
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            metrics.observe("mongo_pool_checkout", time.perf_counter() - started)
+            self._local.started = None
+        metrics.adjust_gauge("mongo_pool_in_use", 1)
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        metrics.incr(f"mongo_pool_checkout_failed_{event.reason}")
+
+    def connection_checked_in(self, event):
+        metrics.adjust_gauge("mongo_pool_in_use", -1)
+
+    def connection_created(self, event):
+        metrics.adjust_gauge("mongo_pool_open_connections", 1)
+
+    def connection_closed(self, event):
+        metrics.adjust_gauge("mongo_pool_open_connections", -1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        metrics.incr("mongo_pool_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+async def ensure_indexes(db):
+    """Create the indexes in COLLECTION_INDEXES; a no-op when they already exist"""
+    for collection_name, indexes in COLLECTION_INDEXES.items():
+        for field, unique in indexes:
+            try:
+                await db[collection_name].create_index(field, unique=unique)
+            except Exception as e:
+                print(f"⚠️ Could not create index {collection_name}.{field}: {e}")
 
 async def connect_to_mongo():
     global client, database
+    if DATABASE_BACKEND != "mongo":
+        print(f"💾 Using local {DATABASE_BACKEND} storage backend")
+        return
     try:
-        client = AsyncIOMotorClient(MONGODB_URL)
+        client = AsyncIOMotorClient(
+            MONGODB_URL,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            event_listeners=[PoolMetricsListener()],
+        )
+        metrics.set_gauge("mongo_pool_max_size", MONGO_MAX_POOL_SIZE)
         database = client[DATABASE_NAME]
         # Test connection
         await client.admin.command('ping')
+        await ensure_indexes(database)
         print(f"✅ Connected to MongoDB at {MONGODB_URL}")
         print(f"📊 Using database: {DATABASE_NAME}")
     except Exception as e:
@@ -31,81 +137,285 @@ async def close_mongo_connection():
     if client:
         client.close()
         print("Disconnected from MongoDB")
+    if _mock_database is not None:
+        _mock_database.close()
+    if _sqlite_database is not None:
+        _sqlite_database.close()
 
 def get_database():
     if database is None:
-        # Return a mock database for basic functionality
-        print("⚠️ Database not available, using persistent mock data")
-        return MockDatabase()
+        # Serve from the shared local store for basic functionality
+        local_backend = FALLBACK_DATABASE_BACKEND if DATABASE_BACKEND == "mongo" else DATABASE_BACKEND
+        if local_backend == "sqlite":
+            return get_sqlite_database()
+        return get_mock_database()
     return database
 
+def get_sqlite_database():
+    """Return the process-wide SQLite database, creating it on first use"""
+    global _sqlite_database
+    if _sqlite_database is None:
+        with _local_database_lock:
+            if _sqlite_database is None:
+                from app.sqlite_database import SQLiteDatabase
+                _sqlite_database = SQLiteDatabase(SQLITE_DB_PATH, indexes=COLLECTION_INDEXES)
+                print(f"💾 Using SQLite storage at {SQLITE_DB_PATH}")
+    return _sqlite_database
+
+def get_mock_database():
+    """Return the process-wide mock database, creating it on first use"""
+    global _mock_database
+    if _mock_database is None:
+        with _local_database_lock:
+            if _mock_database is None:
+                print("⚠️ Database not available, using persistent mock data")
+                _mock_database = MockDatabase()
+    _mock_database.reload_if_changed()
+    return _mock_database
+
 class MockDatabase:
     """Mock database for when MongoDB is not available"""
     def __init__(self):
         self.users = MockCollection()
+        self._last_check = time.monotonic()
+
+    def _collections(self):
+        return [self.users]
+
+    def reload_if_changed(self):
+        """Reload collections whose files were changed by another process"""
+        now = time.monotonic()
+        if now - self._last_check < MOCK_DB_RELOAD_CHECK_SECONDS:
+            return
+        self._last_check = now
+        for collection in self._collections():
+            if collection._store.changed_on_disk():
+                collection._refresh()
+
+    def close(self):
+        for collection in self._collections():
+            collection._store.close()
         
+
 class MockCollection:
     """Mock collection that simulates database operations with persistent storage"""
-    def __init__(self):
-        self._data = {}
+    def __init__(self, unique_indexes=("username", "email"), indexes=(), path=None):
+        # field -> {value: set of document keys}
+        self._indexes = {}
+        self._unique_fields = set()
+        for field in unique_indexes:
+            self._declare_index(field, unique=True)
+        for field in indexes:
+            self._declare_index(field)
+        self._store = JournalStore(
+            path or MOCK_DB_PATH,
+            fsync_interval=MOCK_DB_FSYNC_INTERVAL_MS / 1000,
+            compact_every=MOCK_DB_COMPACT_EVERY,
+        )
         self._load_data()
         
     def _load_data(self):
-        """Load data from file if exists"""
-        try:
-            import json
-            with open('mock_users.json', 'r') as f:
-                self._data = json.load(f)
-        except:
-            self._data = {}
-            
-    def _save_data(self):
-        """Save data to file"""
-        try:
-            import json
-            with open('mock_users.json', 'w') as f:
-                json.dump(self._data, f, default=str)
-        except:
-            pass
+        """Load the snapshot and replay the journal"""
+        self._data = self._store.load()
+        self._rebuild_indexes()
+        metrics.incr("mock_db_loads")
+
+    def _refresh(self):
+        """Apply other processes' writes; a full reload only after their compaction"""
+        changes = self._store.refresh()
+        if changes is None:
+            self._load_data()
+            return
+        for key, previous in changes.items():
+            if isinstance(previous, dict):
+                self._index_remove(key, previous)
+            doc = self._data.get(key)
+            if isinstance(doc, dict):
+                self._index_add(key, doc)
+        metrics.incr("mock_db_refreshes")
+
+    def flush(self):
+        """Force buffered journal writes to disk"""
+        self._store.flush()
+
+    def _declare_index(self, field, unique=False):
+        """Register a secondary hash index on a top-level field"""
+        self._indexes.setdefault(field, {})
+        if unique:
+            self._unique_fields.add(field)
+
+    def _rebuild_indexes(self):
+        """Rebuild every declared index from the loaded documents"""
+        for field in self._indexes:
+            self._indexes[field] = {}
+        for key, doc in self._data.items():
+            if isinstance(doc, dict):
+                self._index_add(key, doc)
+
+    def _index_add(self, key, doc):
+        for field, index in self._indexes.items():
+            value = doc.get(field)
+            if _is_indexable(value):
+                index.setdefault(value, set()).add(key)
+
+    def _index_remove(self, key, doc):
+        for field, index in self._indexes.items():
+            value = doc.get(field)
+            if not _is_indexable(value):
+                continue
+            keys = index.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[value]
+
+    def _check_unique(self, doc, key=None):
+        """Raise DuplicateKeyError if doc collides on a unique index"""
+        for field in self._unique_fields:
+            value = doc.get(field)
+            if not _is_indexable(value):
+                continue
+            if self._indexes[field].get(value, set()) - {key}:
+                from pymongo.errors import DuplicateKeyError
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error on {field}: {value!r}", 11000,
+                    {"keyPattern": {field: 1}, "keyValue": {field: value}},
+                )
+
+    def _candidate_keys(self, query):
+        """Return document keys to scan for query, narrowed by an index if possible"""
+        probes = index_lookups(query, self._indexes.keys() | {"_id"})
+        if probes is None:
+            return list(self._data.keys())
+        if len(probes) == 1 and len(probes[0][1]) == 1:
+            field, (value,) = probes[0]
+            if field == "_id":
+                return [str(value)]
+            return list(self._indexes[field].get(value, ()))
+        keys = set()
+        for field, values in probes:
+            for value in values:
+                if field == "_id":
+                    keys.add(str(value))
+                else:
+                    keys.update(self._indexes[field].get(value, ()))
+        return list(keys)
+
+    def _iter_matches(self, query):
+        matcher = compile_query(query)
+        for key in self._candidate_keys(query or {}):
+            doc = self._data.get(key)
+            if isinstance(doc, dict) and matcher(doc):
+                yield key, doc
+
+    async def create_index(self, field, unique=False, **kwargs):
+        """Declare an index, mirroring Collection.create_index"""
+        self._declare_index(field, unique=unique)
+        self._rebuild_indexes()
+        return f"{field}_1"
         
-    async def find_one(self, query):
+    async def find_one(self, query=None, projection=None):
         """Find one document matching query"""
-        for doc in self._data.values():
-            if isinstance(doc, dict):
-                if 'username' in query and doc.get('username') == query['username']:
-                    return doc
-                if 'email' in query and doc.get('email') == query['email']:
-                    return doc
+        for _, doc in self._iter_matches(query or {}):
+            return project(doc, projection)
         return None
         
-    async def find(self, query=None):
-        """Find all documents matching query"""
-        if query is None:
-            return list(self._data.values())
-        results = []
-        for doc in self._data.values():
-            if isinstance(doc, dict):
-                match = True
-                for key, value in query.items():
-                    if doc.get(key) != value:
-                        match = False
-                        break
-                if match:
-                    results.append(doc)
-        return results
+    def find(self, query=None, projection=None, sort=None, skip=0, limit=0):
+        """Find all documents matching query; returns a Motor-style cursor"""
+        return MockCursor(self, query or {}, projection, sort, skip, limit)
+
+    async def count_documents(self, query):
+        return sum(1 for _ in self._iter_matches(query))
         
     async def insert_one(self, document):
         from bson import ObjectId
+        self._check_unique(document)
         doc_id = ObjectId()
         document['_id'] = doc_id
-        self._data[str(doc_id)] = document
-        self._save_data()
+        key = str(doc_id)
+        self._store.put(key, document)
+        self._index_add(key, document)
         return type('MockResult', (), {'inserted_id': doc_id})()
         
-    async def update_one(self, query, update):
-        self._save_data()
-        return type('MockResult', (), {'modified_count': 1})()
+    async def update_one(self, query, update, upsert=False):
+        match = next(self._iter_matches(query), None)
+        if match is None:
+            upserted_id = None
+            if upsert:
+                result = await self.insert_one(upsert_document(query, update))
+                upserted_id = result.inserted_id
+            return type('MockResult', (), {'matched_count': 0, 'modified_count': 0, 'upserted_id': upserted_id})()
+        key, doc = match
+        updated = apply_update(doc, update)
+        if updated == doc:
+            return type('MockResult', (), {'matched_count': 1, 'modified_count': 0, 'upserted_id': None})()
+        self._check_unique(updated, key)
+        self._index_remove(key, doc)
+        self._store.put(key, updated)
+        self._index_add(key, updated)
+        return type('MockResult', (), {'matched_count': 1, 'modified_count': 1, 'upserted_id': None})()
         
     async def delete_one(self, query):
-        self._save_data()
-        return type('MockResult', (), {'deleted_count': 1})()
\ No newline at end of file
+        match = next(self._iter_matches(query), None)
+        if match is None:
+            return type('MockResult', (), {'deleted_count': 0})()
+        key, doc = match
+        self._index_remove(key, doc)
+        self._store.delete(key)
+        return type('MockResult', (), {'deleted_count': 1})()
+
+
+class MockCursor:
+    """Awaitable, async-iterable result of MockCollection.find
+
+    Supports the Motor cursor calls the app uses (sort/skip/limit chaining,
+    to_list and ``async for``); ``await cursor`` returns the full list.
+    """
+    def __init__(self, collection, query, projection=None, sort=None, skip=0, limit=0):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = normalize_sort(sort)
+        self._skip = skip
+        self._limit = limit
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def _documents(self):
+        docs = (doc for _, doc in self._collection._iter_matches(self._query))
+        if self._sort:
+            top = self._skip + self._limit if self._limit else 0
+            docs = iter(sort_documents(docs, self._sort, limit=top))
+        stop = self._skip + self._limit if self._limit else None
+        for doc in itertools.islice(docs, self._skip, stop):
+            yield project(doc, self._projection)
+
+    async def to_list(self, length=None):
+        docs = self._documents()
+        if length:
+            docs = itertools.islice(docs, length)
+        return list(docs)
+
+    def __await__(self):
+        return self.to_list().__await__()
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def _aiter(self):
+        for doc in self._documents():
+            yield doc
+
+def _is_indexable(value):
+    """Only hashable scalar values are stored in hash indexes"""
+    return value is not None and isinstance(value, (str, int, float, bool))
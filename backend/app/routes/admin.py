@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from typing import Optional
 from app.utils.auth import verify_token
 from app.database import get_database
+from app.routes.auth import USER_PAGE_MAX_LIMIT, fetch_user_page
 import random
 
 router = APIRouter()
@@ -96,27 +98,20 @@ async def get_users_list(page: int = 1, limit: int = 10):
     }
 
 @router.get("/all-users")
-async def get_all_users():
-    """Get all users for admin"""
+async def get_all_users(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=USER_PAGE_MAX_LIMIT),
+    after: Optional[str] = None
+):
+    """Get users for admin; with a limit, keyset paginated on _id (see X-Next-Cursor)"""
     try:
         db = get_database()
         
         # Try to get from database first
         if hasattr(db, 'users'):
-            users = await db.users.find({})
-            user_list = []
-            for user in users:
-                user_data = {
-                    "id": str(user.get("_id", "")),
-                    "username": user.get("username", ""),
-                    "email": user.get("email", ""),
-                    "full_name": user.get("full_name", ""),
-                    "user_type": user.get("user_type", ""),
-                    "phone": user.get("phone", ""),
-                    "created_at": user.get("created_at", ""),
-                    "is_active": user.get("is_active", True)
-                }
-                user_list.append(user_data)
+            user_list, next_cursor = await fetch_user_page(db, limit, after)
+            if next_cursor:
+                response.headers["X-Next-Cursor"] = next_cursor
             return user_list
         else:
             # Return mock data if database not available
@@ -142,6 +137,8 @@ async def get_all_users():
                     "is_active": True
                 }
             ]
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_all_users: {str(e)}")
         # Return mock data on error
@@ -1,16 +1,25 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, Query, UploadFile, File
 from typing import Optional
 import random
-import requests
-import os
 from datetime import datetime, timedelta
 from cachetools import TTLCache
 import json
 
+import numpy as np
+
+from app.schemas.advisory import CropHealthBatchRequest, WeatherBatchRequest
+from app.utils.crop_scoring import CachedFactorTables, encode
+from app.utils.weather import (
+    WEATHER_API_KEY, WEATHER_CACHE_SIZE, WEATHER_MAX_STALE_SECONDS, WeatherError, WeatherService,
+)
+
 router = APIRouter()
 
-# Cache for weather data (5 minutes TTL)
-weather_cache = TTLCache(maxsize=100, ttl=300)
+# Cache for weather data (fresh for 5 minutes, then served stale while it
+# refreshes until WEATHER_MAX_STALE_SECONDS)
+weather_cache = TTLCache(maxsize=WEATHER_CACHE_SIZE, ttl=WEATHER_MAX_STALE_SECONDS)
+# Cached, single-flight upstream lookups; see app/utils/weather.py
+weather = WeatherService(weather_cache)
 
 @router.get("/health")
 async def advisory_health_check():
@@ -28,7 +37,10 @@ async def advisory_health_check():
         "weather_api_key": "configured" if WEATHER_API_KEY != 'demo_key' else "demo_mode",
         "endpoints": [
             "/predict",
+            "/predict/batch",
+            "/crop-ranking",
             "/weather", 
+            "/weather/batch",
             "/recommendations",
             "/sustainability-metrics",
             "/crop-image-analysis"
@@ -36,41 +48,29 @@ async def advisory_health_check():
         "timestamp": datetime.utcnow().isoformat()
     }
 
-# Weather API configuration
-WEATHER_API_KEY = os.getenv('WEATHER_API_KEY', 'demo_key')
-WEATHER_BASE_URL = 'http://api.openweathermap.org/data/2.5'
-
 # Advisory service status
 print(f"🌾 Advisory Service initialized with Weather API: {'configured' if WEATHER_API_KEY != 'demo_key' else 'demo mode'}")
 
-@router.post("/predict")
-async def predict_crop_health(crop: str = "wheat", season: str = "winter", soil_type: str = "loamy"):
-    """AI-powered crop health prediction based on parameters"""
-    
-    # Enhanced AI-based health assessment
-    base_score = 85
-    
-    # Crop-specific adjustments
-    crop_factors = {
-        "wheat": {"winter": 10, "summer": -5, "monsoon": 0},
-        "rice": {"winter": -10, "summer": 5, "monsoon": 15},
-        "corn": {"winter": -5, "summer": 10, "monsoon": 5},
-        "tomato": {"winter": 5, "summer": -10, "monsoon": -5}
-    }
-    
-    # Soil type adjustments
-    soil_factors = {
-        "loamy": 5,
-        "clay": -3,
-        "sandy": -2
-    }
-    
-    # Calculate AI-based health score
-    health_score = base_score
-    health_score += crop_factors.get(crop, {}).get(season, 0)
-    health_score += soil_factors.get(soil_type, 0)
-    health_score += random.randint(-8, 12)  # Environmental variability
-    health_score = max(60, min(95, health_score))
+# Crop health factor tables: points added to BASE_HEALTH_SCORE
+BASE_HEALTH_SCORE = 85
+CROP_SEASON_FACTORS = {
+    "wheat": {"winter": 10, "summer": -5, "monsoon": 0},
+    "rice": {"winter": -10, "summer": 5, "monsoon": 15},
+    "corn": {"winter": -5, "summer": 10, "monsoon": 5},
+    "tomato": {"winter": 5, "summer": -10, "monsoon": -5}
+}
+SOIL_FACTORS = {
+    "loamy": 5,
+    "clay": -3,
+    "sandy": -2
+}
+# The same tables as NumPy lookup arrays and a ranked score tensor, rebuilt
+# whenever the tables above are edited
+crop_factor_tables = CachedFactorTables(lambda: (BASE_HEALTH_SCORE, CROP_SEASON_FACTORS, SOIL_FACTORS))
+_rng = np.random.default_rng()
+
+def crop_health_advice(crop, season, soil_type, health_score):
+    """Recommendations and risk factors for one crop health assessment"""
     
     # Generate intelligent recommendations
     recommendations = [
@@ -124,13 +124,28 @@ async def predict_crop_health(crop: str = "wheat", season: str = "winter", soil_
     if season == "summer" and soil_type == "sandy":
         risk_factors.append("Water stress risk")
     
+    return recommendations[:6], risk_factors  # Limit to 6 recommendations
+
+@router.post("/predict")
+async def predict_crop_health(crop: str = "wheat", season: str = "winter", soil_type: str = "loamy"):
+    """AI-powered crop health prediction based on parameters"""
+    
+    # Calculate AI-based health score
+    health_score = BASE_HEALTH_SCORE
+    health_score += CROP_SEASON_FACTORS.get(crop, {}).get(season, 0)
+    health_score += SOIL_FACTORS.get(soil_type, 0)
+    health_score += random.randint(-8, 12)  # Environmental variability
+    health_score = max(60, min(95, health_score))
+    
+    recommendations, risk_factors = crop_health_advice(crop, season, soil_type, health_score)
+    
     return {
         "crop": crop,
         "season": season,
         "soil_type": soil_type,
         "health_score": health_score,
         "status": "excellent" if health_score > 90 else "healthy" if health_score > 80 else "needs_attention",
-        "recommendations": recommendations[:6],  # Limit to 6 recommendations
+        "recommendations": recommendations,
         "risk_factors": risk_factors,
         "next_check": "5 days" if health_score < 80 else "7 days",
         "confidence": random.randint(88, 96),
@@ -139,42 +154,112 @@ async def predict_crop_health(crop: str = "wheat", season: str = "winter", soil_
         "model_version": "v2.1-enhanced"
     }
 
-@router.get("/weather")
-async def get_weather_advisory(city: str = "Delhi", language: str = "en"):
-    """AI-powered weather-based farming advisory with language support"""
+# Health score cut-offs where the advice text changes (see crop_health_advice)
+_ADVICE_BANDS = np.array([75, 80, 85])
+
+@router.post("/predict/batch")
+async def predict_crop_health_batch(batch: CropHealthBatchRequest):
+    """Crop health predictions for many fields in one call.
+
+    Scores come from the factor tables as NumPy lookup arrays, computed
+    for all fields at once. Fields with the same crop, season, soil and
+    score band get the same advice, which is rendered once per distinct
+    class and referenced from each result by ``advice_id``.
+    """
+    fields = batch.fields
+    tables = crop_factor_tables.get()
+    crops, crop_index = encode([f.crop for f in fields])
+    seasons, season_index = encode([f.season for f in fields])
+    soils, soil_index = encode([f.soil_type for f in fields])
+    
+    health_scores = tables.scores(
+        tables.codes(crops, tables.crops)[crop_index],
+        tables.codes(seasons, tables.seasons)[season_index],
+        tables.codes(soils, tables.soils)[soil_index],
+    )
+    health_scores += _rng.integers(-8, 13, len(fields))  # Environmental variability
+    np.clip(health_scores, 60, 95, out=health_scores)
+    
+    band = np.searchsorted(_ADVICE_BANDS, health_scores, side="right")
+    advice_class = ((crop_index * len(seasons) + season_index) * len(soils) + soil_index) * (len(_ADVICE_BANDS) + 1) + band
+    _, first, advice_ids = np.unique(advice_class, return_index=True, return_inverse=True)
+    advice_ids = advice_ids.reshape(-1)
+    advice = []
+    for advice_id, row in enumerate(first.tolist()):
+        recommendations, risk_factors = crop_health_advice(
+            crops[crop_index[row]], seasons[season_index[row]], soils[soil_index[row]], int(health_scores[row])
+        )
+        advice.append({
+            "advice_id": advice_id,
+            "crop": crops[crop_index[row]],
+            "season": seasons[season_index[row]],
+            "soil_type": soils[soil_index[row]],
+            "recommendations": recommendations,
+            "risk_factors": risk_factors
+        })
+    
+    status_names = ["needs_attention", "healthy", "excellent"]
+    status_codes = np.searchsorted([80, 90], health_scores, side="left")
+    statuses = np.array(status_names)[status_codes]
+    next_checks = np.where(health_scores < 80, "5 days", "7 days")
+    confidences = _rng.integers(88, 97, len(fields))
+    results = [
+        {
+            "field_id": f.field_id,
+            "health_score": score,
+            "status": status,
+            "next_check": next_check,
+            "confidence": confidence,
+            "advice_id": advice_id
+        }
+        for f, score, status, next_check, confidence, advice_id in zip(
+            fields, health_scores.tolist(), statuses.tolist(), next_checks.tolist(),
+            confidences.tolist(), advice_ids.tolist()
+        )
+    ]
+    
+    status_counts = np.bincount(status_codes, minlength=len(status_names)).tolist()
+    return {
+        "results": results,
+        "advice": advice,
+        "summary": {
+            "fields": len(fields),
+            "average_health_score": round(float(health_scores.mean()), 1),
+            "status_counts": {name: count for name, count in zip(status_names, status_counts) if count},
+            "advice_classes": len(advice)
+        },
+        "advisory_type": "ai_agricultural_assessment",
+        "model_version": "v2.1-enhanced"
+    }
+
+@router.get("/crop-ranking")
+async def rank_crops(season: str = "winter", soil_type: str = "loamy", location: str = "Delhi",
+                     k: int = Query(3, ge=1, le=100)):
+    """Top-k crops to plant for a season and soil type, best first.
+
+    Every known crop is ranked from the precomputed crop x season x soil
+    score tensor; score is the table health score, before environmental
+    variability and the 60-95 clamp that /predict applies.
+    """
+    tables = crop_factor_tables.get()
+    ranked = tables.top_crops(season, soil_type, k)
+    return {
+        "season": season,
+        "soil_type": soil_type,
+        "location": location,
+        "top_crops": [
+            {"rank": rank, "crop": crop, "score": score}
+            for rank, (crop, score) in enumerate(ranked, start=1)
+        ],
+        "crops_ranked": len(tables.crops)
+    }
+
+def build_weather_advisory(weather_data):
+    """Farming advisory for one location's weather reading"""
     
-    # Enhanced weather simulation with seasonal patterns
     import datetime
     current_month = datetime.datetime.now().month
     
-    # Seasonal weather patterns for India
-    if current_month in [12, 1, 2]:  # Winter
-        temp_range = (15, 25)
-        humidity_range = (50, 70)
-        rainfall_range = (0, 10)
-    elif current_month in [3, 4, 5]:  # Summer
-        temp_range = (25, 40)
-        humidity_range = (40, 65)
-        rainfall_range = (0, 20)
-    elif current_month in [6, 7, 8, 9]:  # Monsoon
-        temp_range = (22, 32)
-        humidity_range = (70, 90)
-        rainfall_range = (20, 80)
-    else:  # Post-monsoon
-        temp_range = (20, 30)
-        humidity_range = (60, 80)
-        rainfall_range = (0, 30)
-    
-    weather_data = {
-        "city": city,
-        "temperature": random.randint(*temp_range),
-        "humidity": random.randint(*humidity_range),
-        "rainfall": random.randint(*rainfall_range),
-        "wind_speed": random.randint(5, 25),
-        "uv_index": random.randint(3, 11),
-        "soil_temperature": random.randint(temp_range[0]-2, temp_range[1]+2)
-    }
-    
     # AI-generated advisory based on weather conditions
     advisory = []
     priority_alerts = []
@@ -232,7 +317,7 @@ async def get_weather_advisory(city: str = "Delhi", language: str = "en"):
         ])
     
     # UV Index recommendations
-    if weather_data["uv_index"] > 8:
+    if (weather_data["uv_index"] or 0) > 8:
         advisory.append("High UV levels - consider shade protection for sensitive crops")
     
     # Intelligent farming tips based on current conditions
@@ -262,7 +347,58 @@ async def get_weather_advisory(city: str = "Delhi", language: str = "en"):
         "ai_confidence": random.randint(88, 96),
         "forecast_accuracy": "85%",
         "last_updated": datetime.datetime.utcnow().isoformat(),
-        "data_source": "AI Weather Intelligence v2.0"
+        "data_source": "AI Weather Intelligence v2.0",
+        "weather_provider": weather.provider.name
+    }
+
+@router.get("/weather")
+async def get_weather_advisory(city: str = "Delhi", language: str = "en"):
+    """AI-powered weather-based farming advisory with language support"""
+    try:
+        weather_data = await weather.get(city)
+    except WeatherError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return build_weather_advisory(weather_data)
+
+@router.post("/weather/batch")
+async def get_weather_advisories_batch(batch: WeatherBatchRequest):
+    """Weather advisories for many cities and/or lat/lng points at once.
+
+    Readings come from the weather cache where possible; the misses are
+    fetched concurrently, at most WEATHER_BATCH_CONCURRENCY at a time. A
+    location that cannot be looked up gets an error entry of its own.
+    """
+    locations = [(city, {"city": city}) for city in batch.cities]
+    locations += [((point.lat, point.lng), {"lat": point.lat, "lng": point.lng}) for point in batch.points]
+    cached = [weather.is_cached(location) for location, _ in locations]
+    readings = await weather.get_many([location for location, _ in locations])
+    
+    results = []
+    for (_, requested), from_cache, reading in zip(locations, cached, readings):
+        if isinstance(reading, WeatherError):
+            results.append({
+                "location": requested,
+                "status": "error",
+                "error": str(reading),
+                "status_code": reading.status_code
+            })
+        else:
+            results.append({
+                "location": requested,
+                "status": "ok",
+                "cached": from_cache,
+                **build_weather_advisory(reading)
+            })
+    
+    failed = sum(1 for r in results if r["status"] == "error")
+    return {
+        "results": results,
+        "summary": {
+            "requested": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "served_from_cache": sum(cached)
+        }
     }
 
 @router.get("/recommendations")
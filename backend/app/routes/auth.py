@@ -1,19 +1,86 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Form
-from fastapi.security import HTTPBearer
+from fastapi import APIRouter, HTTPException, Depends, status, Form, Query, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from datetime import datetime, timedelta
 from app.schemas.user import UserCreate, UserResponse, Token
-from app.utils.auth import get_password_hash, verify_password, create_access_token, verify_token
+from app.utils.auth import (
+    get_password_hash_async, verify_password_async, create_access_token,
+    get_current_user, get_current_admin, invalidate_user_cache, revoke_subject,
+    password_needs_rehash, rehash_password,
+)
+from app.utils.ratelimit import enforce_auth_rate_limit
 from app.database import get_database
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from bson.errors import InvalidId
+from typing import Optional
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-security = HTTPBearer()
+
+# Fields returned by the user listings; never load password hashes for them
+USER_LIST_PROJECTION = {
+    "username": 1, "email": 1, "full_name": 1, "user_type": 1,
+    "phone": 1, "created_at": 1, "is_active": 1,
+}
+USER_PAGE_MAX_LIMIT = 1000
+
+def serialize_user_summary(user):
+    """Public fields of a user document for admin listings"""
+    return {
+        "id": str(user.get("_id", "")),
+        "username": user.get("username", ""),
+        "email": user.get("email", ""),
+        "full_name": user.get("full_name", ""),
+        "user_type": user.get("user_type", ""),
+        "phone": user.get("phone", ""),
+        "created_at": user.get("created_at", ""),
+        "is_active": user.get("is_active", True)
+    }
+
+async def fetch_user_page(db, limit, after=None):
+    """Return (users, next_cursor) for one keyset page ordered by _id.
+
+    ``after`` is the last _id of the previous page; next_cursor is None on
+    the final page. Without a limit every remaining user is returned, as
+    the listings did before they were paginated.
+    """
+    query = {}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if limit is None:
+        cursor = db.users.find(query, USER_LIST_PROJECTION).sort("_id", 1)
+        return [serialize_user_summary(user) async for user in cursor], None
+    cursor = db.users.find(query, USER_LIST_PROJECTION).sort("_id", 1).limit(limit + 1)
+    users = await cursor.to_list(limit + 1)
+    next_cursor = str(users[limit - 1]["_id"]) if len(users) > limit else None
+    return [serialize_user_summary(user) for user in users[:limit]], next_cursor
+
+async def stream_users_ndjson(db):
+    """Yield every user as one JSON line, reading the cursor batch by batch"""
+    async for user in db.users.find({}, USER_LIST_PROJECTION).sort("_id", 1):
+        yield json.dumps(serialize_user_summary(user), default=str) + "\n"
+
+def _duplicate_field(error):
+    """Unique field a DuplicateKeyError collided on, or None if it does not say.
+
+    MongoDB, the mock and the SQLite store all report it in the error
+    details as keyPattern/keyValue.
+    """
+    details = error.details or {}
+    for key in ("keyPattern", "keyValue"):
+        if details.get(key):
+            return next(iter(details[key]))
+    return None
 
 @router.post("/register", response_model=dict)
-async def register_user(user: UserCreate):
+async def register_user(user: UserCreate, request: Request):
+    await enforce_auth_rate_limit(request, user.username)
     try:
         print(f"📝 Registration attempt for user: {user.username}")
         db = get_database()
@@ -23,24 +90,28 @@ async def register_user(user: UserCreate):
             print("❌ Registration failed: Missing required fields")
             raise HTTPException(status_code=422, detail="All required fields must be provided")
         
+        # Look up the values as they will be stored
+        username = user.username.strip()
+        email = user.email.strip().lower()
+        
         # Check if username exists (skip if mock database)
         if hasattr(db, 'users'):
-            existing_username = await db.users.find_one({"username": user.username})
+            existing_username = await db.users.find_one({"username": username})
             if existing_username:
                 print(f"❌ Registration failed: Username {user.username} already exists")
                 raise HTTPException(status_code=400, detail="Username already exists. Please choose a different username.")
             
             # Check if email exists
-            existing_email = await db.users.find_one({"email": user.email})
+            existing_email = await db.users.find_one({"email": email})
             if existing_email:
                 print(f"❌ Registration failed: Email {user.email} already exists")
                 raise HTTPException(status_code=400, detail="Email already registered. Please use a different email or login with existing account.")
         
         # Create user
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash_async(user.password)
         user_doc = {
-            "username": user.username.strip(),
-            "email": user.email.strip().lower(),
+            "username": username,
+            "email": email,
             "full_name": user.full_name.strip(),
             "user_type": user.user_type,
             "phone": getattr(user, 'phone', None),
@@ -50,7 +121,18 @@ async def register_user(user: UserCreate):
         }
         
         print(f"✅ Creating user: {user_doc['username']}")
-        result = await db.users.insert_one(user_doc)
+        try:
+            result = await db.users.insert_one(user_doc)
+        except DuplicateKeyError as e:
+            # A concurrent registration took the name or email after the checks above
+            print(f"❌ Registration failed: duplicate key for {user_doc['username']}")
+            field = _duplicate_field(e)
+            if field == "email":
+                raise HTTPException(status_code=400, detail="Email already registered. Please use a different email or login with existing account.")
+            if field == "username":
+                raise HTTPException(status_code=400, detail="Username already exists. Please choose a different username.")
+            raise HTTPException(status_code=400, detail="Username or email already registered.")
+        invalidate_user_cache(user_doc["username"])
         print(f"🎉 User created successfully with ID: {result.inserted_id}")
         
         return {
@@ -67,7 +149,8 @@ async def register_user(user: UserCreate):
         raise HTTPException(status_code=500, detail=f"Registration error: {str(e)}")
 
 @router.post("/login", response_model=Token)
-async def login_user(username: str = Form(), password: str = Form()):
+async def login_user(request: Request, background_tasks: BackgroundTasks, username: str = Form(), password: str = Form()):
+    await enforce_auth_rate_limit(request, username)
     try:
         print(f"🔐 Login attempt for user: {username}")
         db = get_database()
@@ -91,7 +174,7 @@ async def login_user(username: str = Form(), password: str = Form()):
             raise HTTPException(status_code=401, detail="Username not found. Please register first.")
         
         # Verify password
-        if not verify_password(password, user["hashed_password"]):
+        if not await verify_password_async(password, user["hashed_password"]):
             print(f"❌ Login failed: Incorrect password for user {username}")
             raise HTTPException(status_code=401, detail="Incorrect password. Please try again.")
         
@@ -100,6 +183,10 @@ async def login_user(username: str = Form(), password: str = Form()):
             print(f"❌ Login failed: User {username} is deactivated")
             raise HTTPException(status_code=401, detail="Account is deactivated. Please contact support.")
         
+        # Upgrade hashes made with a lower bcrypt cost after responding
+        if password_needs_rehash(user["hashed_password"]):
+            background_tasks.add_task(rehash_password, user["username"], password, user["hashed_password"])
+        
         # Create access token with user type
         access_token_expires = timedelta(minutes=30)
         access_token = create_access_token(
@@ -116,14 +203,7 @@ async def login_user(username: str = Form(), password: str = Form()):
         raise HTTPException(status_code=500, detail="Login error occurred")
 
 @router.get("/profile", response_model=dict)
-async def get_user_profile(token: str = Depends(security)):
-    username = verify_token(token.credentials)
-    db = get_database()
-    
-    user = await db.users.find_one({"username": username})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+async def get_user_profile(user: dict = Depends(get_current_user)):
     return {
         "id": str(user["_id"]),
         "username": user["username"],
@@ -134,33 +214,25 @@ async def get_user_profile(token: str = Depends(security)):
     }
 
 @router.get("/users", response_model=list)
-async def get_all_users(token: str = Depends(security)):
-    """Get all registered users - Admin only"""
+async def get_all_users(
+    response: Response,
+    admin: dict = Depends(get_current_admin),
+    limit: Optional[int] = Query(None, ge=1, le=USER_PAGE_MAX_LIMIT),
+    after: Optional[str] = None
+):
+    """Get registered users - Admin only.
+
+    Keyset paginated on _id when ``limit`` is given: pass the X-Next-Cursor
+    header of one page as ``after`` to fetch the next one. Without a limit
+    all users are returned.
+    """
     try:
-        # Verify token and get current user
-        username = verify_token(token.credentials)
+        username = admin["username"]
         db = get_database()
         
-        # Check if current user is admin
-        current_user = await db.users.find_one({"username": username})
-        if not current_user or current_user.get("user_type") != "admin":
-            raise HTTPException(status_code=403, detail="Access denied. Admin privileges required.")
-        
-        users = await db.users.find({})
-        
-        user_list = []
-        for user in users:
-            user_data = {
-                "id": str(user.get("_id", "")),
-                "username": user.get("username", ""),
-                "email": user.get("email", ""),
-                "full_name": user.get("full_name", ""),
-                "user_type": user.get("user_type", ""),
-                "phone": user.get("phone", ""),
-                "created_at": user.get("created_at", ""),
-                "is_active": user.get("is_active", True)
-            }
-            user_list.append(user_data)
+        user_list, next_cursor = await fetch_user_page(db, limit, after)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         
         print(f"📊 Admin {username} retrieved {len(user_list)} users")
         return user_list
@@ -170,18 +242,43 @@ async def get_all_users(token: str = Depends(security)):
         print(f"❌ Error retrieving users: {str(e)}")
         raise HTTPException(status_code=500, detail="Error retrieving users")
 
+@router.get("/users/export")
+async def export_all_users(admin: dict = Depends(get_current_admin)):
+    """Stream all users as NDJSON - Admin only"""
+    db = get_database()
+    return StreamingResponse(stream_users_ndjson(db), media_type="application/x-ndjson")
+
+@router.put("/users/{username}/deactivate", response_model=dict)
+async def deactivate_user(username: str, admin: dict = Depends(get_current_admin)):
+    """Deactivate a user account - Admin only"""
+    db = get_database()
+    result = await db.users.update_one({"username": username}, {"$set": {"is_active": False}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    invalidate_user_cache(username)
+    revoke_subject(username)
+    print(f"🚫 Admin {admin['username']} deactivated user {username}")
+    return {"message": f"User {username} deactivated"}
+
 @router.put("/profile", response_model=dict)
-async def update_user_profile(full_name: str = None, email: str = None, token: str = Depends(security)):
-    username = verify_token(token.credentials)
+async def update_user_profile(full_name: str = None, email: str = None, user: dict = Depends(get_current_user)):
+    username = user["username"]
     db = get_database()
     
     update_data = {}
     if full_name:
         update_data["full_name"] = full_name
     if email:
-        update_data["email"] = email
+        update_data["email"] = email.strip().lower()
     
     if update_data:
-        await db.users.update_one({"username": username}, {"$set": update_data})
+        try:
+            result = await db.users.update_one({"username": username}, {"$set": update_data})
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Email already registered. Please use a different email.")
+        finally:
+            invalidate_user_cache(username)
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="User not found")
     
     return {"message": "Profile updated successfully"}
\ No newline at end of file
@@ -1,7 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from typing import Optional
+from datetime import datetime, timezone
 import random
 
+import numpy as np
+
+from ..schemas.marketplace import OrderBatchCreate
+from ..utils.catalog import CONVENTIONAL_CARBON_KG, CatalogIndex
+from ..utils.http_cache import make_etag, not_modified
+from ..utils.inventory import OutOfStock, ReservationBook, select_stock
+from ..utils.query import project
+
 router = APIRouter()
 
 # Enhanced mock products data with sustainability metrics and proper images
@@ -233,93 +242,163 @@ MOCK_PRODUCTS = [
     }
 ]
 
+# Approximate seller coordinates for each listing location
+SELLER_COORDINATES = {
+    "Punjab": (30.901, 75.857),
+    "UP": (26.847, 80.947),
+    "Tamil Nadu": (13.083, 80.271),
+    "Himachal Pradesh": (31.105, 77.173),
+    "Assam": (26.145, 91.736),
+    "Haryana": (29.686, 76.990),
+    "Rajasthan": (26.912, 75.787),
+    "Local": (28.614, 77.209),
+    "Maharashtra": (18.520, 73.857),
+    "Kerala": (9.931, 76.267),
+    "Karnataka": (12.972, 77.595),
+    "Gujarat": (23.023, 72.571),
+    "Delhi": (28.614, 77.209),
+    "Andhra Pradesh": (16.506, 80.648),
+    "Bangalore": (12.972, 77.595),
+}
+
+for _product in MOCK_PRODUCTS:
+    if _product["location"] in SELLER_COORDINATES:
+        _product["lat"], _product["lng"] = SELLER_COORDINATES[_product["location"]]
+
+# Indexes over MOCK_PRODUCTS; edit listings through it so it stays current
+catalog = CatalogIndex(MOCK_PRODUCTS)
+PRODUCT_PAGE_MAX_LIMIT = 200
+
+def find_product(product_id):
+    """Look up a listing by id in O(1); accepts the str ids used by OrderItem"""
+    product = catalog.get(product_id)
+    if product is None and isinstance(product_id, str) and product_id.isdigit():
+        product = catalog.get(int(product_id))
+    return product
+
+# Stock taken by orders that are not paid yet; see app/utils/inventory.py
+reservations = ReservationBook(select_stock(find_product, on_change=catalog.touch))
+
+def order_quantity(item):
+    """Quantity of a create_order line item; 422 unless it is a positive int"""
+    quantity = item.get('quantity', 1) if isinstance(item, dict) else None
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+        raise HTTPException(status_code=422, detail="Each item needs a positive integer quantity")
+    return quantity
+
+def reservation_summary(reservation):
+    return {
+        "reservation_id": reservation["reservation_id"],
+        "payment_due_by": datetime.fromtimestamp(reservation["expires_at"], tz=timezone.utc).isoformat()
+    }
+
 @router.get("/products")
 async def get_products(
+    request: Request,
+    response: Response,
     category: Optional[str] = None, 
     search: Optional[str] = None,
     organic_only: bool = False,
     max_distance: Optional[int] = None,
     sort_by: str = "name",
-    min_sustainability: Optional[int] = None
+    min_sustainability: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PRODUCT_PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180)
 ):
-    """Enhanced product search with sustainability filters"""
-    products = MOCK_PRODUCTS.copy()
-    
-    # Apply filters
-    if category:
-        products = [p for p in products if p["category"] == category]
-    
-    if search:
-        products = [p for p in products if search.lower() in p["name"].lower() or search.lower() in p["description"].lower()]
-    
-    if organic_only:
-        products = [p for p in products if p["organic"]]
-    
-    if max_distance:
-        products = [p for p in products if p["distance_km"] <= max_distance]
-    
-    if min_sustainability:
-        products = [p for p in products if p["sustainability_score"] >= min_sustainability]
-    
-    # Sort products
-    if sort_by == "price_low":
-        products.sort(key=lambda x: x["price"])
-    elif sort_by == "price_high":
-        products.sort(key=lambda x: x["price"], reverse=True)
-    elif sort_by == "distance":
-        products.sort(key=lambda x: x["distance_km"])
-    elif sort_by == "sustainability":
-        products.sort(key=lambda x: x["sustainability_score"], reverse=True)
-    elif sort_by == "rating":
-        products.sort(key=lambda x: x["rating"], reverse=True)
-    elif sort_by == "freshness":
-        products.sort(key=lambda x: x["harvest_date"], reverse=True)
+    """Enhanced product search with sustainability filters.
+
+    Without ``limit`` every match is returned. With it, pass the
+    ``next_cursor`` of one page as ``after`` to fetch the next. ``fields``
+    is a comma-separated list of product fields to return (id is always
+    included); metrics always cover every match. With the buyer's
+    ``lat``/``lng``, max_distance, sort_by=distance and distance_km are
+    measured from the buyer to each seller.
+
+    The ETag covers the catalog version and the query string, so an
+    If-None-Match revalidation is answered with 304 before any querying.
+    """
+    if (lat is None) != (lng is None):
+        raise HTTPException(status_code=400, detail="Provide both lat and lng")
+    etag = make_etag("products", catalog.version, sorted(request.query_params.multi_items()))
+    unchanged = not_modified(request, response, etag)
+    if unchanged is not None:
+        return unchanged
+    origin = (lat, lng) if lat is not None else None
+    try:
+        result = catalog.query(
+            category=category or None,
+            organic_only=organic_only,
+            max_distance=max_distance or None,
+            min_sustainability=min_sustainability or None,
+            sort_by=sort_by,
+            search=search or None,
+            limit=limit,
+            after=after,
+            origin=origin,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid pagination cursor: {e}")
+    if result.next_cursor:
+        response.headers["X-Next-Cursor"] = result.next_cursor
     
-    # Calculate total carbon savings
-    total_carbon_saved = sum(2.5 - p["carbon_footprint"] for p in products if p["carbon_footprint"] < 2.5)
+    page = result.products
+    if fields:
+        projection = ["id"] + [f.strip() for f in fields.split(",") if f.strip()]
+        page = [project(p, projection) for p in page]
     
     return {
-        "products": products,
-        "total_products": len(products),
+        "products": page,
+        "total_products": result.total,
+        "next_cursor": result.next_cursor,
         "filters_applied": {
             "category": category,
             "organic_only": organic_only,
             "max_distance": max_distance,
-            "min_sustainability": min_sustainability
+            "min_sustainability": min_sustainability,
+            "buyer_location": {"lat": lat, "lng": lng} if origin else None
         },
-        "sustainability_metrics": {
-            "avg_sustainability_score": round(sum(p["sustainability_score"] for p in products) / len(products), 1) if products else 0,
-            "organic_percentage": round(sum(1 for p in products if p["organic"]) / len(products) * 100, 1) if products else 0,
-            "avg_distance_km": round(sum(p["distance_km"] for p in products) / len(products), 1) if products else 0,
-            "total_carbon_saved_kg": round(total_carbon_saved, 2)
-        }
+        "sustainability_metrics": result.metrics
     }
 
 @router.get("/products/{product_id}")
-async def get_product(product_id: int):
-    """Get single product"""
-    product = next((p for p in MOCK_PRODUCTS if p["id"] == product_id), None)
+async def get_product(product_id: int, request: Request, response: Response):
+    """Get single product; its ETag changes whenever the listing does"""
+    product = catalog.get(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    unchanged = not_modified(request, response, make_etag("product", product_id, catalog.product_version(product_id)))
+    if unchanged is not None:
+        return unchanged
     return product
 
+CATEGORIES = [
+    {"id": "grains", "name": "Grains", "icon": "🌾"},
+    {"id": "vegetables", "name": "Vegetables", "icon": "🥕"},
+    {"id": "fruits", "name": "Fruits", "icon": "🍎"},
+    {"id": "dairy", "name": "Dairy", "icon": "🥛"},
+    {"id": "spices", "name": "Spices", "icon": "🌶️"},
+    {"id": "supplies", "name": "Supplies", "icon": "🛠️"}
+]
+CATEGORIES_ETAG = make_etag("categories", CATEGORIES)
+
 @router.get("/categories")
-async def get_categories():
+async def get_categories(request: Request, response: Response):
     """Get product categories"""
-    return {
-        "categories": [
-            {"id": "grains", "name": "Grains", "icon": "🌾"},
-            {"id": "vegetables", "name": "Vegetables", "icon": "🥕"},
-            {"id": "fruits", "name": "Fruits", "icon": "🍎"},
-            {"id": "dairy", "name": "Dairy", "icon": "🥛"},
-            {"id": "spices", "name": "Spices", "icon": "🌶️"},
-            {"id": "supplies", "name": "Supplies", "icon": "🛠️"}
-        ]
-    }
+    unchanged = not_modified(request, response, CATEGORIES_ETAG)
+    if unchanged is not None:
+        return unchanged
+    return {"categories": CATEGORIES}
 
 @router.post("/orders")
 async def create_order(order_data: dict):
-    """Enhanced order creation with sustainability tracking"""
+    """Enhanced order creation with sustainability tracking.
+
+    The ordered quantities are reserved from stock (409 when a product is
+    short) until the order is paid or the reservation expires.
+    """
     
     order_id = random.randint(1000, 9999)
     
@@ -329,10 +408,17 @@ async def create_order(order_data: dict):
     organic_items = 0
     total_items = len(order_data.get('items', []))
     
-    for item in order_data.get('items', []):
-        product = next((p for p in MOCK_PRODUCTS if p['id'] == item.get('product_id')), None)
+    quantities = [order_quantity(item) for item in order_data.get('items', [])]
+    found = [(item, find_product(item.get('product_id'))) for item in order_data.get('items', [])]
+    try:
+        reservation = await reservations.reserve(
+            [(product['id'], quantity) for (item, product), quantity in zip(found, quantities) if product]
+        )
+    except OutOfStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    for (item, product), quantity in zip(found, quantities):
         if product:
-            quantity = item.get('quantity', 1)
             total_carbon_footprint += product['carbon_footprint'] * quantity
             total_distance += product['distance_km']
             if product['organic']:
@@ -346,6 +432,7 @@ async def create_order(order_data: dict):
         "status": "confirmed",
         "message": "Order placed successfully",
         "estimated_delivery": "2-3 days",
+        "reservation": reservation_summary(reservation),
         "sustainability_impact": {
             "carbon_footprint_kg": round(total_carbon_footprint, 2),
             "carbon_saved_kg": round(max(0, carbon_saved), 2),
@@ -359,6 +446,107 @@ async def create_order(order_data: dict):
         }
     }
 
+@router.post("/orders/batch")
+async def create_orders_batch(batch: OrderBatchCreate):
+    """Place many orders at once (B2B).
+
+    Every line item is looked up in the id map, then the sustainability
+    impact of all orders is computed together with NumPy. An order that
+    names an unknown product, or one that is short of stock, is rejected
+    on its own; the rest are reserved and go through.
+    """
+    rejected = {}
+    reserved = {}
+    line_order, carbon, distance, organic, sustainability, quantity = [], [], [], [], [], []
+    sellers = [set() for _ in batch.orders]
+    for index, order in enumerate(batch.orders):
+        products = [find_product(item.product_id) for item in order.items]
+        missing = [item.product_id for item, product in zip(order.items, products) if product is None]
+        if missing:
+            rejected[index] = f"Unknown product id(s): {', '.join(missing)}"
+            continue
+        try:
+            reserved[index] = await reservations.reserve(
+                [(product["id"], item.quantity) for item, product in zip(order.items, products)]
+            )
+        except OutOfStock as e:
+            rejected[index] = str(e)
+            continue
+        for item, product in zip(order.items, products):
+            line_order.append(index)
+            carbon.append(product["carbon_footprint"])
+            distance.append(product["distance_km"])
+            organic.append(product["organic"])
+            sustainability.append(product["sustainability_score"])
+            quantity.append(item.quantity)
+            sellers[index].add(product["seller"])
+
+    orders_count = len(batch.orders)
+    line_order = np.array(line_order, dtype=np.int64)
+    carbon = np.array(carbon, dtype=np.float64) * np.array(quantity, dtype=np.float64)
+    per_order = lambda weights: np.bincount(line_order, weights=weights, minlength=orders_count)
+    items = np.bincount(line_order, minlength=orders_count)
+    carbon_total = per_order(carbon)
+    distance_total = per_order(np.array(distance, dtype=np.float64))
+    organic_total = per_order(np.array(organic, dtype=np.float64))
+    sustainability_total = per_order(np.array(sustainability, dtype=np.float64))
+    # vs conventional supply chain
+    carbon_saved = np.maximum(0, CONVENTIONAL_CARBON_KG * items - carbon_total)
+    safe_items = np.maximum(items, 1)
+
+    results = []
+    for index in range(orders_count):
+        if index in rejected:
+            results.append({"index": index, "status": "rejected", "error": rejected[index]})
+            continue
+        results.append({
+            "index": index,
+            "order_id": random.randint(1000, 9999),
+            "status": "confirmed",
+            "estimated_delivery": "2-3 days",
+            "reservation": reservation_summary(reserved[index]),
+            "sustainability_impact": {
+                "carbon_footprint_kg": round(float(carbon_total[index]), 2),
+                "carbon_saved_kg": round(float(carbon_saved[index]), 2),
+                "avg_distance_km": round(float(distance_total[index] / safe_items[index]), 1),
+                "organic_percentage": round(float(organic_total[index] / safe_items[index] * 100), 1),
+                "sustainability_score": round(float(sustainability_total[index] / safe_items[index]))
+            },
+            "farmer_support": {
+                "farmers_supported": len(sellers[index]),
+                "fair_trade_premium": "15% above market rate"
+            }
+        })
+
+    line_items = len(line_order)
+    return {
+        "orders": results,
+        "summary": {
+            "orders_received": orders_count,
+            "orders_confirmed": orders_count - len(rejected),
+            "orders_rejected": len(rejected),
+            "line_items": line_items,
+            "carbon_footprint_kg": round(float(carbon_total.sum()), 2),
+            "carbon_saved_kg": round(float(carbon_saved.sum()), 2),
+            "organic_percentage": round(float(organic_total.sum()) / line_items * 100, 1) if line_items else 0,
+            "farmers_supported": len(set().union(*sellers))
+        }
+    }
+
+@router.post("/orders/reservations/{reservation_id}/confirm")
+async def confirm_reservation(reservation_id: str):
+    """Mark an order's reservation paid so its stock is kept"""
+    if not await reservations.confirm(reservation_id):
+        raise HTTPException(status_code=404, detail="Reservation not found or expired")
+    return {"reservation_id": reservation_id, "status": "paid"}
+
+@router.delete("/orders/reservations/{reservation_id}")
+async def cancel_reservation(reservation_id: str):
+    """Cancel an unpaid order and return its stock"""
+    if not await reservations.release(reservation_id):
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return {"reservation_id": reservation_id, "status": "cancelled"}
+
 @router.get("/orders")
 async def get_orders():
     """Get user orders"""
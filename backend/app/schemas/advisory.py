@@ -0,0 +1,26 @@
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
+
+class GeoPoint(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+
+class WeatherBatchRequest(BaseModel):
+    cities: List[str] = Field(default_factory=list, max_length=100)
+    points: List[GeoPoint] = Field(default_factory=list, max_length=100)
+    language: str = "en"
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        if not self.cities and not self.points:
+            raise ValueError("Provide at least one city or point")
+        return self
+
+class FieldRecord(BaseModel):
+    field_id: Optional[str] = None
+    crop: str = "wheat"
+    season: str = "winter"
+    soil_type: str = "loamy"
+
+class CropHealthBatchRequest(BaseModel):
+    fields: List[FieldRecord] = Field(..., min_length=1, max_length=20000)
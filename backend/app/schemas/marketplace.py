@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -29,7 +29,7 @@ class ProductResponse(ProductBase):
 
 class OrderItem(BaseModel):
     product_id: str
-    quantity: int
+    quantity: int = Field(..., gt=0)
     price: float
 
 class OrderCreate(BaseModel):
@@ -38,6 +38,9 @@ class OrderCreate(BaseModel):
     phone: str
     notes: Optional[str] = None
 
+class OrderBatchCreate(BaseModel):
+    orders: List[OrderCreate] = Field(..., min_length=1, max_length=1000)
+
 class OrderResponse(BaseModel):
     id: str
     buyer_id: str
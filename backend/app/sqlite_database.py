@@ -0,0 +1,350 @@
+"""SQLite (WAL) storage backend with the same async collection interface
+as Motor and the JSON mock: find_one, find, insert_one, update_one,
+delete_one, count_documents and create_index.
+
+Each collection is a table of JSON documents keyed by _id, with expression
+indexes on the declared fields. All SQLite calls run on one dedicated
+thread that owns the connection, so the event loop never blocks on disk.
+"""
+import asyncio
+import json
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.utils.query import (
+    apply_update, compile_query, normalize_sort, project, sort_documents,
+    upsert_document,
+)
+
+_FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_RANGE_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+FETCH_BATCH_SIZE = 500
+
+
+def _sql_value(value):
+    """Convert a query value to what json_extract returns, or raise TypeError"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        # Documents are stored with json.dumps(default=str)
+        return str(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(f"Cannot push {type(value).__name__} down to SQLite")
+
+
+class SQLiteDatabase:
+    """SQLite database holding the users, products and orders collections"""
+    def __init__(self, path, indexes=None):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = self._executor.submit(self._connect).result()
+        self._collections = {}
+        self.users = self["users"]
+        self.products = self["products"]
+        self.orders = self["orders"]
+        for name, fields in (indexes or {}).items():
+            collection = self[name]
+            for field, unique in fields:
+                self.run_sync(collection._create_index, field, unique)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = SQLiteCollection(self, name)
+        return self._collections[name]
+
+    def run_sync(self, fn, *args):
+        return self._executor.submit(fn, *args).result()
+
+    async def run(self, fn, *args):
+        """Run a blocking SQLite call on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def close(self):
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown()
+
+
+class SQLiteCollection:
+    """One table of JSON documents; mirrors the Motor collection methods we use"""
+    def __init__(self, database, name):
+        if not _FIELD_NAME.match(name):
+            raise ValueError(f"Invalid collection name: {name}")
+        self._db = database
+        self.name = name
+        self._indexed = set()
+        # Fixed statement text so sqlite3 reuses the prepared statements
+        self._sql_insert = f"INSERT INTO {name} (id, doc) VALUES (?, ?)"
+        self._sql_update = f"UPDATE {name} SET doc = ? WHERE id = ?"
+        self._sql_delete = f"DELETE FROM {name} WHERE id = ?"
+        self._sql_select = f"SELECT doc FROM {name}"
+        self._sql_count = f"SELECT COUNT(*) FROM {name}"
+        self._db.run_sync(self._create_table)
+
+    def _create_table(self):
+        self._db._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.name} (id TEXT PRIMARY KEY, doc TEXT NOT NULL)"
+        )
+
+    def _create_index(self, field, unique=False):
+        if not _FIELD_NAME.match(field):
+            raise ValueError(f"Invalid index field: {field}")
+        if field != "_id":
+            kind = "UNIQUE INDEX" if unique else "INDEX"
+            self._db._conn.execute(
+                f"CREATE {kind} IF NOT EXISTS idx_{self.name}_{field} "
+                f"ON {self.name} (json_extract(doc, '$.{field}'))"
+            )
+            self._indexed.add(field)
+        return f"{field}_1"
+
+    def _duplicate_key_error(self, error, doc):
+        """DuplicateKeyError naming the field, in MongoDB's keyPattern/keyValue details"""
+        # SQLite names the index ("index 'idx_users_email'") or the key column
+        field = next(
+            (f for f in self._indexed if f"'idx_{self.name}_{f}'" in str(error)), "_id"
+        )
+        return DuplicateKeyError(
+            f"E11000 duplicate key error in {self.name}: {error}", 11000,
+            {"keyPattern": {field: 1}, "keyValue": {field: doc.get(field)}},
+        )
+
+    def _column(self, field):
+        if field == "_id":
+            return "id"
+        if field in self._indexed:
+            return f"json_extract(doc, '$.{field}')"
+        return None
+
+    def _where(self, query):
+        """Translate indexed predicates to SQL.
+
+        Returns (sql, params, exact); exact is False when part of the query
+        must still be checked by the compiled matcher in Python.
+        """
+        clauses, params, exact = [], [], True
+        for field, condition in query.items():
+            column = None if field.startswith("$") else self._column(field)
+            if column is None:
+                exact = False
+                continue
+            is_operator_dict = isinstance(condition, dict) and condition and all(
+                k.startswith("$") for k in condition
+            )
+            operators = condition if is_operator_dict else {"$eq": condition}
+            for op, arg in operators.items():
+                try:
+                    if op == "$eq":
+                        values = [_sql_value(arg)]
+                        clause = f"{column} = ?"
+                    elif op == "$in":
+                        values = [_sql_value(v) for v in arg]
+                        clause = f"{column} IN ({', '.join('?' * len(values))})" if values else "0"
+                    elif op in _RANGE_OPERATORS:
+                        values = [_sql_value(arg)]
+                        clause = f"{column} {_RANGE_OPERATORS[op]} ?"
+                        if field != "_id":
+                            # SQLite orders mixed types differently from
+                            # the matcher, so re-check in Python
+                            exact = False
+                    else:
+                        exact = False
+                        continue
+                except TypeError:
+                    exact = False
+                    continue
+                clauses.append(clause)
+                params.extend(values)
+        sql = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return sql, params, exact
+
+    def _decode(self, row):
+        return json.loads(row[0])
+
+    def _plan(self, query, sort=None, skip=0, limit=0):
+        """Build the SELECT for query.
+
+        Returns (sql, params, pushed); when pushed is True the SQL already
+        applies the whole query, sort, skip and limit.
+        """
+        where, params, exact = self._where(query)
+        sql = self._sql_select + where
+        pushed = exact and (not sort or (len(sort) == 1 and sort[0][0] == "_id"))
+        if pushed:
+            if sort:
+                sql += " ORDER BY id DESC" if sort[0][1] < 0 else " ORDER BY id"
+            if limit or skip:
+                sql += " LIMIT ? OFFSET ?"
+                params = params + [limit or -1, skip]
+        return sql, params, pushed
+
+    def _find_sync(self, query, sort, skip, limit):
+        sql, params, pushed = self._plan(query, sort, skip, limit)
+        docs = (self._decode(row) for row in self._db._conn.execute(sql, params))
+        if pushed:
+            return list(docs)
+        matcher = compile_query(query)
+        docs = [doc for doc in docs if matcher(doc)]
+        if sort:
+            docs = sort_documents(docs, sort, limit=skip + limit if limit else 0)
+        return docs[skip:skip + limit] if limit else docs[skip:]
+
+    def _find_one_sync(self, query):
+        sql, params, pushed = self._plan(query, limit=1)
+        matcher = None if pushed else compile_query(query)
+        for row in self._db._conn.execute(sql, params):
+            doc = self._decode(row)
+            if matcher is None or matcher(doc):
+                return doc
+        return None
+
+    async def create_index(self, field, unique=False, **kwargs):
+        return await self._db.run(self._create_index, field, unique)
+
+    async def find_one(self, query=None, projection=None):
+        doc = await self._db.run(self._find_one_sync, query or {})
+        return project(doc, projection) if doc is not None else None
+
+    def find(self, query=None, projection=None, sort=None, skip=0, limit=0):
+        """Find documents matching query; returns a Motor-style cursor"""
+        return SQLiteCursor(self, query or {}, projection, sort, skip, limit)
+
+    async def count_documents(self, query):
+        def count():
+            where, params, exact = self._where(query)
+            if exact:
+                return self._db._conn.execute(self._sql_count + where, params).fetchone()[0]
+            return len(self._find_sync(query, None, 0, 0))
+        return await self._db.run(count)
+
+    def _insert_sync(self, document):
+        doc_id = document.get("_id") or ObjectId()
+        stored = dict(document, _id=str(doc_id))
+        try:
+            self._db._conn.execute(self._sql_insert, (str(doc_id), json.dumps(stored, default=str)))
+        except sqlite3.IntegrityError as e:
+            raise self._duplicate_key_error(e, stored)
+        return doc_id
+
+    async def insert_one(self, document):
+        doc_id = await self._db.run(self._insert_sync, document)
+        document['_id'] = doc_id
+        return type('MockResult', (), {'inserted_id': doc_id})()
+
+    def _update_sync(self, query, update, upsert):
+        conn = self._db._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            doc = self._find_one_sync(query)
+            if doc is None:
+                upserted_id = self._insert_sync(upsert_document(query, update)) if upsert else None
+                conn.execute("COMMIT")
+                return 0, 0, upserted_id
+            updated = apply_update(doc, update)
+            modified = 0
+            if updated != doc:
+                conn.execute(self._sql_update, (json.dumps(updated, default=str), doc["_id"]))
+                modified = 1
+            conn.execute("COMMIT")
+            return 1, modified, None
+        except sqlite3.IntegrityError as e:
+            conn.execute("ROLLBACK")
+            raise self._duplicate_key_error(e, updated)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def update_one(self, query, update, upsert=False):
+        matched, modified, upserted_id = await self._db.run(self._update_sync, query, update, upsert)
+        return type('MockResult', (), {
+            'matched_count': matched, 'modified_count': modified, 'upserted_id': upserted_id,
+        })()
+
+    def _delete_sync(self, query):
+        doc = self._find_one_sync(query)
+        if doc is None:
+            return 0
+        # 0 when another process deleted it since the read
+        return self._db._conn.execute(self._sql_delete, (doc["_id"],)).rowcount
+
+    async def delete_one(self, query):
+        deleted = await self._db.run(self._delete_sync, query)
+        return type('MockResult', (), {'deleted_count': deleted})()
+
+
+class SQLiteCursor:
+    """Awaitable, async-iterable cursor over a SQLiteCollection query"""
+    def __init__(self, collection, query, projection=None, sort=None, skip=0, limit=0):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = normalize_sort(sort)
+        self._skip = skip
+        self._limit = limit
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    async def to_list(self, length=None):
+        limit = self._limit
+        if length:
+            limit = min(limit, length) if limit else length
+        c = self._collection
+        docs = await c._db.run(c._find_sync, self._query, self._sort, self._skip, limit)
+        return [project(doc, self._projection) for doc in docs]
+
+    def __await__(self):
+        return self.to_list().__await__()
+
+    async def __aiter__(self):
+        c = self._collection
+        sql, params, pushed = c._plan(self._query, self._sort, self._skip, self._limit)
+        if not pushed and self._sort:
+            # Sorting in Python needs every matching row anyway
+            for doc in await self.to_list():
+                yield doc
+            return
+        cursor = await c._db.run(c._db._conn.execute, sql, params)
+        matcher = None if pushed else compile_query(self._query)
+        skip = 0 if pushed else self._skip
+        remaining = None if pushed or not self._limit else self._limit
+        while remaining != 0:
+            rows = await c._db.run(cursor.fetchmany, FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                doc = c._decode(row)
+                if matcher is not None and not matcher(doc):
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                yield project(doc, self._projection)
+                if remaining is not None:
+                    remaining -= 1
+                    if remaining == 0:
+                        break
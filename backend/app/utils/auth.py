@@ -3,15 +3,52 @@ from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
-from fastapi.security import HTTPBearer
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from cachetools import TTLCache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.utils import metrics
+import asyncio
+import hashlib
 import os
+import threading
+import time
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# bcrypt runs on its own threads so it never blocks the event loop;
+# beyond PASSWORD_HASH_QUEUE_LIMIT pending jobs new requests get a 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+
+# bcrypt work factor: BCRYPT_ROUNDS pins it, otherwise startup calibration
+# picks the highest cost in [BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS] whose hash
+# time stays within BCRYPT_TARGET_MS on this machine.
+BCRYPT_ROUNDS = os.getenv("BCRYPT_ROUNDS")
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", "14"))
+
+# Decoded claims of already-verified tokens, keyed by SHA-256 of the token
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# Resolved user documents; per-process, so other workers see changes
+# after at most USER_CACHE_TTL_SECONDS
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending_hash_jobs = 0
+_token_cache = OrderedDict()  # digest -> (claims, exp timestamp)
+_token_cache_lock = threading.Lock()
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+# Never keep password hashes in the identity cache
+CURRENT_USER_PROJECTION = {"hashed_password": 0}
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -19,6 +56,92 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def password_needs_rehash(hashed_password):
+    """True when a stored hash was made with a lower bcrypt cost"""
+    return pwd_context.needs_update(hashed_password)
+
+def set_bcrypt_rounds(rounds):
+    """Hash at rounds; only hashes made with a lower cost need an update.
+
+    Hashes above rounds are left alone: workers or hosts that calibrate to
+    different costs would otherwise rehash each user back and forth, and
+    a slower host would downgrade what a faster one made.
+    """
+    pwd_context.update(
+        bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=None
+    )
+    metrics.set_gauge("bcrypt_rounds", rounds)
+
+def calibrate_bcrypt_rounds(target_ms=BCRYPT_TARGET_MS, min_rounds=BCRYPT_MIN_ROUNDS, max_rounds=BCRYPT_MAX_ROUNDS):
+    """Pick the highest cost whose hash time fits target_ms.
+
+    Times one hash at min_rounds and extrapolates, since every extra round
+    doubles the work.
+    """
+    probe = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=min_rounds)
+    probe.hash("calibration")  # warm up the backend
+    started = time.perf_counter()
+    probe.hash("calibration")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 ** (rounds + 1 - min_rounds) <= target_ms:
+        rounds += 1
+    return rounds
+
+def configure_password_hashing():
+    """Set the bcrypt cost at startup from BCRYPT_ROUNDS or calibration"""
+    if BCRYPT_ROUNDS:
+        rounds = int(BCRYPT_ROUNDS)
+    else:
+        rounds = calibrate_bcrypt_rounds()
+    set_bcrypt_rounds(rounds)
+    print(f"🔑 bcrypt cost set to {rounds} rounds")
+    return rounds
+
+async def _run_password_job(fn, *args):
+    """Run a bcrypt call on the hashing pool, recording queue wait and hash time"""
+    global _pending_hash_jobs
+    if _pending_hash_jobs >= PASSWORD_HASH_QUEUE_LIMIT:
+        metrics.incr("password_hash_rejected")
+        raise HTTPException(status_code=503, detail="Server is busy, please try again shortly")
+    _pending_hash_jobs += 1
+    metrics.set_gauge("password_hash_pending", _pending_hash_jobs)
+    submitted = time.perf_counter()
+
+    def job():
+        started = time.perf_counter()
+        metrics.observe("password_hash_queue_wait", started - submitted)
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe("password_hash_time", time.perf_counter() - started)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, job)
+    finally:
+        _pending_hash_jobs -= 1
+        metrics.set_gauge("password_hash_pending", _pending_hash_jobs)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_password_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_password_job(get_password_hash, password)
+
+async def rehash_password(username, password, old_hash):
+    """Re-hash a password at the current cost and store it (background task)"""
+    from app.database import get_database
+    try:
+        new_hash = await get_password_hash_async(password)
+        # Only replace the hash we verified against, never a newer one
+        await get_database().users.update_one(
+            {"username": username, "hashed_password": old_hash},
+            {"$set": {"hashed_password": new_hash}},
+        )
+        metrics.incr("password_rehashes")
+    except Exception as e:
+        print(f"⚠️ Password rehash failed for {username}: {e}")
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -29,12 +152,92 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
+def _token_digest(token: str):
+    return hashlib.sha256(token.encode()).digest()
+
+def _cached_claims(digest):
+    with _token_cache_lock:
+        entry = _token_cache.get(digest)
+        if entry is None:
+            return None
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            del _token_cache[digest]
+            return None
+        _token_cache.move_to_end(digest)
+        return claims
+
+def _cache_claims(digest, claims):
+    expires_at = claims.get("exp")
+    if not isinstance(expires_at, (int, float)) or TOKEN_CACHE_SIZE <= 0:
+        return
+    with _token_cache_lock:
+        _token_cache[digest] = (claims, expires_at)
+        _token_cache.move_to_end(digest)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+def decode_token(token: str):
+    """Return the verified claims of token, from cache when already verified"""
+    digest = _token_digest(token)
+    claims = _cached_claims(digest)
+    if claims is not None:
+        metrics.incr("token_cache_hits")
+        return claims
+    metrics.incr("token_cache_misses")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return username
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid token")
+    _cache_claims(digest, claims)
+    return claims
+
+def revoke_token(token: str):
+    """Drop a token's cached claims so its next use is fully re-verified"""
+    with _token_cache_lock:
+        _token_cache.pop(_token_digest(token), None)
+
+def revoke_subject(username: str):
+    """Drop cached claims of every token issued to username"""
+    with _token_cache_lock:
+        stale = [d for d, (claims, _) in _token_cache.items() if claims.get("sub") == username]
+        for digest in stale:
+            del _token_cache[digest]
+
+def verify_token(token: str):
+    username: str = decode_token(token).get("sub")
+    if username is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return username
+
+
+def invalidate_user_cache(username: str):
+    """Forget the cached identity of username after its document changes"""
+    _user_cache.pop(username, None)
+
+async def get_current_user(token: HTTPAuthorizationCredentials = Depends(security)):
+    """FastAPI dependency resolving the authenticated user document.
+
+    FastAPI resolves it once per request; the document comes from a short
+    TTL identity cache so authorization checks skip the database.
+    """
+    from app.database import get_database
+    username = verify_token(token.credentials)
+    user = _user_cache.get(username)
+    if user is None:
+        metrics.incr("user_cache_misses")
+        user = await get_database().users.find_one({"username": username}, CURRENT_USER_PROJECTION)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        _user_cache[username] = user
+    else:
+        metrics.incr("user_cache_hits")
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=401, detail="Account is deactivated. Please contact support.")
+    return user
+
+async def get_current_admin(user: dict = Depends(get_current_user)):
+    """FastAPI dependency that only lets admins through"""
+    if user.get("user_type") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied. Admin privileges required.")
+    return user
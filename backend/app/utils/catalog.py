@@ -0,0 +1,598 @@
+"""Precomputed indexes over the marketplace catalog.
+
+The index is rebuilt lazily after the product list changes and then
+answers filtered, sorted product queries without rescanning every listing:
+
+* per-category and organic bitsets (NumPy boolean masks) plus their
+  posting lists of row numbers;
+* for every sortable field a sorted permutation of the rows and each row's
+  rank in it, so range filters are a binary search and sorting a subset
+  is an argsort of small integers.
+
+A query starts from the most selective candidate set (a posting list or a
+range slice), checks the remaining predicates on those rows only, and
+orders them by rank. Text search comes from an incrementally maintained
+TextIndex and acts as one more candidate set, ranked by relevance unless
+an explicit sort is requested.
+
+Every listing gets a sequence number when it is first added. Ties in every
+ordering break on it, which keeps catalog order within equal values and
+lets a page cursor (last sort value, last sequence number) resume at the
+right place even after listings were added or removed.
+
+Sustainability metrics for a result come from running totals kept per
+(category, organic_only) combination and updated on every listing change,
+so unfiltered, category-only and organic-only requests read them in O(1).
+Any other filter sums the matched rows' precomputed columns in one
+vectorized pass.
+
+With a buyer location, distances are measured from the buyer to the
+seller's coordinates instead of the listing's static distance_km (which
+remains the fallback for listings without coordinates). A grid index
+limits radius filters to nearby cells and serves distance-sorted pages by
+a k-nearest ring search.
+
+``version`` counts changes to the catalog and each listing remembers the
+version at which it last changed, which is what HTTP validators (ETags)
+are derived from.
+"""
+import base64
+import heapq
+import json
+import threading
+
+import numpy as np
+
+from .geo import GridIndex, haversine_km
+from .search import TextIndex
+
+# sort_by value -> (field, direction); anything else keeps catalog order
+SORT_FIELDS = {
+    "price_low": ("price", 1),
+    "price_high": ("price", -1),
+    "distance": ("distance_km", 1),
+    "sustainability": ("sustainability_score", -1),
+    "rating": ("rating", -1),
+    "freshness": ("harvest_date", -1),
+}
+INDEXED_FIELDS = ("price", "distance_km", "sustainability_score", "rating", "harvest_date")
+# Above this fraction of the catalog, filtering the full sorted order is
+# cheaper than argsorting the candidates
+_DENSE_RESULT_FRACTION = 0.125
+# Carbon footprint (kg) of the conventional supply chain we compare against
+CONVENTIONAL_CARBON_KG = 2.5
+
+
+def _contribution(product):
+    """What one listing adds to the running metric totals"""
+    carbon = product.get("carbon_footprint", 0)
+    return (
+        1,
+        product.get("sustainability_score", 0),
+        1 if product.get("organic") else 0,
+        product.get("distance_km", 0),
+        CONVENTIONAL_CARBON_KG - carbon if carbon < CONVENTIONAL_CARBON_KG else 0,
+    )
+
+
+def sustainability_metrics(count, sustainability_sum, organic_count, distance_sum, carbon_saved):
+    """The sustainability_metrics block of a product listing response"""
+    if not count:
+        return {
+            "avg_sustainability_score": 0,
+            "organic_percentage": 0,
+            "avg_distance_km": 0,
+            "total_carbon_saved_kg": 0,
+        }
+    return {
+        "avg_sustainability_score": round(sustainability_sum / count, 1),
+        "organic_percentage": round(organic_count / count * 100, 1),
+        "avg_distance_km": round(distance_sum / count, 1),
+        "total_carbon_saved_kg": round(carbon_saved, 2),
+    }
+
+
+def _coordinate(product, key):
+    value = product.get(key)
+    return float(value) if value is not None else np.nan
+
+
+def encode_cursor(mode, value, seq):
+    raw = json.dumps([mode, value, seq], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, mode):
+    """Return (value, seq) from a cursor, or raise ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_mode, value, seq = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_mode != mode or not isinstance(seq, int):
+        raise ValueError("Cursor does not belong to this sort order")
+    return value, seq
+
+
+class _SortedField:
+    """Rows of one field in ascending order, with each row's rank"""
+    def __init__(self, values, seq):
+        n = len(values)
+        self.labels = None
+        if values.dtype.kind in "US":
+            # Compare strings through their dense codes
+            self.labels, values = np.unique(values, return_inverse=True)
+            values = values.astype(np.float64)
+        self.values = values
+        self.ascending = np.lexsort((seq, values))
+        self.descending = np.lexsort((seq, -values))
+        self.rank_ascending = np.empty(n, dtype=np.int64)
+        self.rank_ascending[self.ascending] = np.arange(n)
+        self.rank_descending = np.empty(n, dtype=np.int64)
+        self.rank_descending[self.descending] = np.arange(n)
+        self.sorted_values = values[self.ascending]
+        # Keys and tie-breakers of each order, both ascending, for cursors
+        self._keys = {1: self.sorted_values, -1: -values[self.descending]}
+        self._seqs = {1: seq[self.ascending], -1: seq[self.descending]}
+
+    def order(self, direction):
+        return self.ascending if direction > 0 else self.descending
+
+    def rank(self, direction):
+        return self.rank_ascending if direction > 0 else self.rank_descending
+
+    def at_most(self, bound):
+        """Rows with value <= bound, in ascending value order"""
+        end = np.searchsorted(self.sorted_values, bound, side="right")
+        return self.ascending[:end]
+
+    def at_least(self, bound):
+        """Rows with value >= bound, in ascending value order"""
+        start = np.searchsorted(self.sorted_values, bound, side="left")
+        return self.ascending[start:]
+
+    def raw(self, row):
+        """JSON-friendly value of row, as stored in cursors"""
+        value = self.values[row]
+        return str(self.labels[int(value)]) if self.labels is not None else float(value)
+
+    def _key(self, raw):
+        if self.labels is None:
+            return float(raw)
+        # A label missing from this snapshot sorts between its neighbours
+        i = int(np.searchsorted(self.labels, str(raw)))
+        present = i < len(self.labels) and self.labels[i] == str(raw)
+        return float(i) if present else i - 0.5
+
+    def position_after(self, direction, raw, seq):
+        """How many entries of the order come at or before (raw, seq)"""
+        key = self._key(raw) * (1 if direction > 0 else -1)
+        keys, seqs = self._keys[direction], self._seqs[direction]
+        low = int(np.searchsorted(keys, key, side="left"))
+        high = int(np.searchsorted(keys, key, side="right"))
+        return low + int(np.searchsorted(seqs[low:high], seq, side="right"))
+
+
+class _Snapshot:
+    """Immutable index over one version of the product list"""
+    def __init__(self, products, sequence):
+        self.rows = list(products)
+        n = len(self.rows)
+        self.size = n
+        self.positions = {p["id"]: i for i, p in enumerate(self.rows)}
+        self.seq = np.fromiter((sequence[p["id"]] for p in self.rows), dtype=np.int64, count=n)
+        categories = np.array([p.get("category", "") for p in self.rows], dtype=object)
+        self.category_masks = {}
+        self.category_rows = {}
+        for category in set(categories.tolist()):
+            mask = categories == category
+            self.category_masks[category] = mask
+            self.category_rows[category] = np.flatnonzero(mask)
+        self.organic_mask = np.fromiter(
+            (bool(p.get("organic")) for p in self.rows), dtype=bool, count=n
+        )
+        self.organic_rows = np.flatnonzero(self.organic_mask)
+        carbon = np.fromiter(
+            (float(p.get("carbon_footprint") or 0) for p in self.rows), dtype=np.float64, count=n
+        )
+        self.carbon_saved = np.where(carbon < CONVENTIONAL_CARBON_KG, CONVENTIONAL_CARBON_KG - carbon, 0.0)
+        self.fields = {}
+        for field in INDEXED_FIELDS:
+            if field == "harvest_date":
+                values = np.array([str(p.get(field) or "") for p in self.rows], dtype=str)
+            else:
+                values = np.fromiter(
+                    (float(p.get(field) or 0) for p in self.rows), dtype=np.float64, count=n
+                )
+            self.fields[field] = _SortedField(values, self.seq)
+        # Catalog order is just another sorted field, keyed on the sequence
+        self.natural = _SortedField(self.seq.astype(np.float64), self.seq)
+        self.lat = np.fromiter((_coordinate(p, "lat") for p in self.rows), dtype=np.float64, count=n)
+        self.lng = np.fromiter((_coordinate(p, "lng") for p in self.rows), dtype=np.float64, count=n)
+        self.has_coordinates = ~(np.isnan(self.lat) | np.isnan(self.lng))
+        located = np.flatnonzero(self.has_coordinates)
+        self.grid = GridIndex(located, self.lat[located], self.lng[located])
+        self.unlocated_rows = np.flatnonzero(~self.has_coordinates)
+
+    def distances_from(self, origin, rows):
+        """Buyer-relative distances of rows, or their listed distance_km
+        when the seller has no coordinates"""
+        distances = self.fields["distance_km"].values[rows]
+        located = self.has_coordinates[rows]
+        if located.all():
+            return haversine_km(origin[0], origin[1], self.lat[rows], self.lng[rows])
+        distances = distances.copy()
+        located_rows = rows[located]
+        distances[located] = haversine_km(origin[0], origin[1], self.lat[located_rows], self.lng[located_rows])
+        return distances
+
+    def _within(self, origin, radius_km):
+        rows, _ = self.grid.within(origin[0], origin[1], radius_km)
+        if len(self.unlocated_rows):
+            listed = self.fields["distance_km"].values[self.unlocated_rows]
+            rows = np.concatenate((rows, self.unlocated_rows[listed <= radius_km]))
+        return rows
+
+    def filter(self, category=None, organic_only=False, max_distance=None,
+               min_sustainability=None, relevance=None, origin=None):
+        """Rows matching every filter (None when nothing is filtered).
+
+        relevance maps product id to a search score; only those products
+        match. origin is the buyer's (lat, lng) that max_distance is
+        measured from. Returns (rows, scores) with scores keyed by row.
+        """
+        distance = self.fields["distance_km"]
+        sustainability = self.fields["sustainability_score"]
+
+        scores = None
+        candidates = []
+        if relevance is not None:
+            scores = {self.positions[i]: s for i, s in relevance.items() if i in self.positions}
+            candidates.append(("search", np.fromiter(scores, dtype=np.int64, count=len(scores))))
+        if category is not None:
+            candidates.append(("category", self.category_rows.get(category, np.empty(0, np.int64))))
+        if organic_only:
+            candidates.append(("organic", self.organic_rows))
+        if max_distance is not None:
+            if origin is not None:
+                candidates.append(("distance", self._within(origin, max_distance)))
+            else:
+                candidates.append(("distance", distance.at_most(max_distance)))
+        if min_sustainability is not None:
+            candidates.append(("sustainability", sustainability.at_least(min_sustainability)))
+        if not candidates:
+            return None, None
+
+        source, rows = min(candidates, key=lambda c: len(c[1]))
+        keep = np.ones(len(rows), dtype=bool)
+        if scores is not None and source != "search":
+            keep &= np.fromiter((r in scores for r in rows.tolist()), dtype=bool, count=len(rows))
+        if category is not None and source != "category":
+            mask = self.category_masks.get(category)
+            keep &= mask[rows] if mask is not None else False
+        if organic_only and source != "organic":
+            keep &= self.organic_mask[rows]
+        if max_distance is not None and source != "distance":
+            if origin is not None:
+                keep &= self.distances_from(origin, rows) <= max_distance
+            else:
+                keep &= distance.values[rows] <= max_distance
+        if min_sustainability is not None and source != "sustainability":
+            keep &= sustainability.values[rows] >= min_sustainability
+        return rows[keep], scores
+
+    def order(self, rows, sort_by=None, scores=None, limit=None, after=None, origin=None):
+        """Order matching rows for sort_by and cut one page.
+
+        Returns (page_rows, next_cursor). Only the page is fully sorted:
+        the first ``limit`` rows are picked by partial selection.
+        """
+        if origin is not None and sort_by == "distance":
+            return self._order_by_nearest(rows, origin, limit, after)
+        field, direction = SORT_FIELDS.get(sort_by, (None, 1))
+        if field is None and scores is not None:
+            return self._order_by_relevance(rows, scores, limit, after)
+        if field is None:
+            mode, sorted_field, direction = "catalog", self.natural, 1
+        else:
+            mode, sorted_field = sort_by, self.fields[field]
+
+        start = 0
+        if after is not None:
+            start = sorted_field.position_after(direction, *decode_cursor(after, mode))
+        order = sorted_field.order(direction)
+        if rows is None:
+            page = order[start:start + limit] if limit else order[start:]
+            remaining = len(order) - start
+        elif len(rows) > self.size * _DENSE_RESULT_FRACTION:
+            selected = np.zeros(self.size, dtype=bool)
+            selected[rows] = True
+            tail = order[start:]
+            tail = tail[selected[tail]]
+            page, remaining = (tail[:limit] if limit else tail), len(tail)
+        else:
+            ranks = sorted_field.rank(direction)[rows]
+            if start:
+                later = ranks >= start
+                rows, ranks = rows[later], ranks[later]
+            remaining = len(rows)
+            if limit and limit < remaining:
+                first = np.argpartition(ranks, limit - 1)[:limit]
+                rows, ranks = rows[first], ranks[first]
+            page = rows[np.argsort(ranks)]
+
+        next_cursor = None
+        if limit and remaining > len(page):
+            last = int(page[-1])
+            next_cursor = encode_cursor(mode, sorted_field.raw(last), int(self.seq[last]))
+        return page, next_cursor
+
+    def _order_by_relevance(self, rows, scores, limit, after):
+        entries = ((-scores[r], int(self.seq[r]), r) for r in rows.tolist())
+        if after is not None:
+            score, seq = decode_cursor(after, "relevance")
+            cutoff = (-float(score), seq)
+            entries = (e for e in entries if (e[0], e[1]) > cutoff)
+        entries = list(entries)
+        if limit and limit < len(entries):
+            page = heapq.nsmallest(limit, entries)
+        else:
+            page = sorted(entries)
+        next_cursor = None
+        if limit and len(entries) > len(page):
+            last_score, last_seq, _ = page[-1]
+            next_cursor = encode_cursor("relevance", -last_score, last_seq)
+        return np.array([e[2] for e in page], dtype=np.int64), next_cursor
+
+    def _order_by_nearest(self, rows, origin, limit, after):
+        cursor = decode_cursor(after, "nearest") if after is not None else None
+        seq = self.seq
+
+        def accept(candidates, distances):
+            keep = np.ones(len(candidates), dtype=bool) if allowed is None else allowed[candidates]
+            if cursor is not None:
+                later = (distances > cursor[0]) | ((distances == cursor[0]) & (seq[candidates] > cursor[1]))
+                keep &= later
+            return keep
+
+        allowed = None
+        if limit and (rows is None or len(rows) > self.size * _DENSE_RESULT_FRACTION):
+            # Ring search from the buyer; ask for one extra to know if more remain
+            if rows is not None:
+                allowed = np.zeros(self.size, dtype=bool)
+                allowed[rows] = True
+            candidates, distances = self.grid.nearest(
+                origin[0], origin[1], limit + 1, accept, cursor[0] if cursor else 0.0
+            )
+            if len(self.unlocated_rows):
+                extra = self.unlocated_rows
+                extra_distances = self.fields["distance_km"].values[extra]
+                keep = accept(extra, extra_distances)
+                candidates = np.concatenate((candidates, extra[keep]))
+                distances = np.concatenate((distances, extra_distances[keep]))
+        else:
+            candidates = np.arange(self.size) if rows is None else rows
+            distances = self.distances_from(origin, candidates)
+            keep = accept(candidates, distances)
+            candidates, distances = candidates[keep], distances[keep]
+
+        remaining = len(candidates)
+        if limit and limit < remaining:
+            # Keep every row tied with the limit-th distance, then sort exactly
+            bound = np.partition(distances, limit - 1)[limit - 1]
+            close = distances <= bound
+            candidates, distances = candidates[close], distances[close]
+        ordered = np.lexsort((seq[candidates], distances))
+        if limit:
+            ordered = ordered[:limit]
+        page = candidates[ordered]
+        next_cursor = None
+        if limit and remaining > len(page):
+            last = ordered[-1]
+            next_cursor = encode_cursor("nearest", float(distances[last]), int(seq[candidates[last]]))
+        return page, next_cursor
+
+    def metrics(self, rows, origin=None):
+        """Sustainability metrics over rows in one vectorized pass"""
+        if rows is None:
+            rows = np.arange(self.size)
+        if origin is not None:
+            distance_sum = float(self.distances_from(origin, rows).sum())
+        else:
+            distance_sum = float(self.fields["distance_km"].values[rows].sum())
+        return sustainability_metrics(
+            len(rows),
+            float(self.fields["sustainability_score"].values[rows].sum()),
+            int(self.organic_mask[rows].sum()),
+            distance_sum,
+            float(self.carbon_saved[rows].sum()),
+        )
+
+
+class CatalogPage:
+    """One page of a catalog query, plus the size and metrics of the whole result"""
+    def __init__(self, snapshot, total, page, next_cursor, metrics, origin=None):
+        self.total = total
+        self.products = [snapshot.rows[i] for i in page.tolist()]
+        if origin is not None and len(page):
+            # Report the distance from this buyer on copies of the listings
+            distances = snapshot.distances_from(origin, page).tolist()
+            self.products = [
+                dict(p, distance_km=round(d, 1)) for p, d in zip(self.products, distances)
+            ]
+        self.next_cursor = next_cursor
+        self.metrics = metrics
+
+
+class CatalogIndex:
+    """Query index over a mutable product list, rebuilt when it changes"""
+    def __init__(self, products):
+        self._products = products
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._text = TextIndex()
+        self._sequence = {}
+        self._next_sequence = 0
+        # (category, organic_only) -> [count, sustainability, organic, distance, carbon saved]
+        self._totals = {}
+        self._counted = {}
+        self._by_id = {}
+        # product id -> catalog version at which that listing last changed
+        self._product_versions = {}
+        for product in products:
+            self._by_id[product["id"]] = product
+            self._product_versions[product["id"]] = 0
+            self._text.add(product["id"], product)
+            self._assign_sequence(product["id"])
+            self._count(product["id"], product)
+        self.version = 0
+
+    def _assign_sequence(self, product_id):
+        if product_id not in self._sequence:
+            self._sequence[product_id] = self._next_sequence
+            self._next_sequence += 1
+
+    def _count(self, product_id, product):
+        """Replace product_id's share of the running totals with product's"""
+        previous = self._counted.pop(product_id, None)
+        if previous is not None:
+            self._apply(*previous, sign=-1)
+        if product is not None:
+            entry = (product.get("category"), bool(product.get("organic")), _contribution(product))
+            self._counted[product_id] = entry
+            self._apply(*entry, sign=1)
+
+    def _apply(self, category, organic, contribution, sign):
+        keys = [(None, False), (category, False)]
+        if organic:
+            keys += [(None, True), (category, True)]
+        for key in keys:
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = self._totals[key] = [0, 0, 0, 0, 0]
+            for i, value in enumerate(contribution):
+                totals[i] += sign * value
+            if totals[0] == 0:
+                # Drop empty groups so float residue cannot leak into metrics
+                del self._totals[key]
+
+    def invalidate(self, product_id=None):
+        """Mark the index stale after the product list was edited in place.
+
+        Pass product_id when only that listing changed, so its search
+        entry is refreshed; otherwise search is re-indexed from scratch.
+        """
+        with self._lock:
+            if product_id is None:
+                self._text = TextIndex()
+                self._totals, self._counted = {}, {}
+                self._by_id = {p["id"]: p for p in self._products}
+                for product in self._products:
+                    self._text.add(product["id"], product)
+                    self._assign_sequence(product["id"])
+                    self._count(product["id"], product)
+                self.version += 1
+                self._product_versions = dict.fromkeys(self._by_id, self.version)
+            else:
+                product = next((p for p in self._products if p["id"] == product_id), None)
+                if product is None:
+                    self._by_id.pop(product_id, None)
+                    self._text.remove(product_id)
+                    self._sequence.pop(product_id, None)
+                    self._product_versions.pop(product_id, None)
+                else:
+                    self._by_id[product_id] = product
+                    self._text.add(product_id, product)
+                    self._assign_sequence(product_id)
+                self._count(product_id, product)
+                self.version += 1
+                if product is not None:
+                    self._product_versions[product_id] = self.version
+            self._snapshot = None
+
+    def upsert(self, product):
+        """Add a product, or replace the one with the same id"""
+        with self._lock:
+            existing = self._by_id.get(product["id"])
+            if existing is not None:
+                self._products[self._products.index(existing)] = product
+            else:
+                self._products.append(product)
+            self._by_id[product["id"]] = product
+            self._text.add(product["id"], product)
+            self._assign_sequence(product["id"])
+            self._count(product["id"], product)
+            self.version += 1
+            self._product_versions[product["id"]] = self.version
+            self._snapshot = None
+
+    def touch(self, product_id):
+        """Record an in-place edit of fields the index does not cover.
+
+        Stock levels change on every order; they only need new versions,
+        not a rebuilt index.
+        """
+        with self._lock:
+            if product_id in self._by_id:
+                self.version += 1
+                self._product_versions[product_id] = self.version
+
+    def remove(self, product_id):
+        """Remove a product; returns False when it was not listed"""
+        with self._lock:
+            existing = self._by_id.pop(product_id, None)
+            if existing is None:
+                return False
+            self._products.remove(existing)
+            self._text.remove(product_id)
+            self._sequence.pop(product_id, None)
+            self._count(product_id, None)
+            self._product_versions.pop(product_id, None)
+            self.version += 1
+            self._snapshot = None
+            return True
+
+    def get(self, product_id):
+        """The listing with product_id, or None, in O(1)"""
+        return self._by_id.get(product_id)
+
+    def product_version(self, product_id):
+        """Catalog version at which product_id last changed, or None"""
+        return self._product_versions.get(product_id)
+
+    def snapshot(self):
+        """The index for the current product list, building it if stale"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = _Snapshot(self._products, self._sequence)
+                snapshot = self._snapshot
+        return snapshot
+
+    def query(self, category=None, organic_only=False, max_distance=None,
+              min_sustainability=None, sort_by=None, search=None, limit=None, after=None,
+              origin=None):
+        """Products matching the filters and search text, in sort_by order.
+
+        Returns a CatalogPage with at most ``limit`` products, starting
+        after the ``after`` cursor; raises ValueError for a bad cursor.
+        origin is the buyer's (lat, lng) for distance filters and sorting.
+        """
+        relevance = self._text.search(search) if search else None
+        snapshot = self.snapshot()
+        rows, scores = snapshot.filter(
+            category, organic_only, max_distance, min_sustainability, relevance, origin
+        )
+        page, next_cursor = snapshot.order(rows, sort_by, scores, limit, after, origin)
+        if origin is None and relevance is None and max_distance is None and min_sustainability is None:
+            metrics = self.metrics(category, organic_only)
+        else:
+            metrics = snapshot.metrics(rows, origin)
+        total = snapshot.size if rows is None else len(rows)
+        return CatalogPage(snapshot, total, page, next_cursor, metrics, origin)
+
+    def metrics(self, category=None, organic_only=False):
+        """Sustainability metrics for a category/organic filter, in O(1)"""
+        totals = self._totals.get((category, bool(organic_only)))
+        return sustainability_metrics(*(totals or (0, 0, 0, 0, 0)))
@@ -0,0 +1,96 @@
+"""Crop health factor tables as NumPy lookup arrays.
+
+The advisory factor tables are nested dicts (crop -> season -> points, and
+soil -> points). FactorTables lays them out as arrays indexed by small
+integer codes, so scoring many fields is a couple of fancy-indexing
+operations instead of a dict lookup chain per field. Every axis has one
+extra trailing slot worth 0 points for names the tables do not know,
+matching ``dict.get(name, 0)``.
+
+The full crop x season x soil score tensor is precomputed too, with every
+crop ranked for each (season, soil) pair, so "best crops here" is a dict
+lookup and a slice. CachedFactorTables rebuilds all of it only when the
+source dicts change.
+"""
+import threading
+
+import numpy as np
+
+
+class FactorTables:
+    """base + crop_season[crop, season] + soil[soil], as arrays"""
+    def __init__(self, base, crop_season_factors, soil_factors):
+        self.base = base
+        self.crops = list(crop_season_factors)
+        self.seasons = list(dict.fromkeys(
+            season for factors in crop_season_factors.values() for season in factors
+        ))
+        self.soils = list(soil_factors)
+        self.crop_season = np.zeros((len(self.crops) + 1, len(self.seasons) + 1), dtype=np.int64)
+        for i, crop in enumerate(self.crops):
+            for j, season in enumerate(self.seasons):
+                self.crop_season[i, j] = crop_season_factors[crop].get(season, 0)
+        self.soil = np.zeros(len(self.soils) + 1, dtype=np.int64)
+        for k, soil in enumerate(self.soils):
+            self.soil[k] = soil_factors[soil]
+        # crop x season x soil scores (unknown season/soil slots included)
+        self.tensor = self.base + self.crop_season[:len(self.crops), :, None] + self.soil[None, None, :]
+        order = np.argsort(-self.tensor, axis=0, kind="stable")
+        self._season_index = {season: j for j, season in enumerate(self.seasons)}
+        self._soil_index = {soil: k for k, soil in enumerate(self.soils)}
+        self._ranked = {}
+        for j in range(len(self.seasons) + 1):
+            for k in range(len(self.soils) + 1):
+                self._ranked[j, k] = [
+                    (self.crops[i], int(self.tensor[i, j, k])) for i in order[:, j, k].tolist()
+                ]
+
+    @staticmethod
+    def codes(names, vocabulary):
+        """Index of each name in vocabulary; unknown names get the 0-point slot"""
+        lookup = {name: i for i, name in enumerate(vocabulary)}
+        return np.array([lookup.get(name, len(vocabulary)) for name in names], dtype=np.intp)
+
+    def scores(self, crop_codes, season_codes, soil_codes):
+        """Table score (before variability and clamping) for each code triple"""
+        return self.base + self.crop_season[crop_codes, season_codes] + self.soil[soil_codes]
+
+    def top_crops(self, season, soil_type, k):
+        """[(crop, table score)] of the k best crops for season and soil, best first"""
+        j = self._season_index.get(season, len(self.seasons))
+        o = self._soil_index.get(soil_type, len(self.soils))
+        return self._ranked[j, o][:k]
+
+
+class CachedFactorTables:
+    """FactorTables for dicts that may be edited in place.
+
+    source() returns (base, crop_season_factors, soil_factors); get()
+    compares them with what the current tables were built from (a few
+    microseconds for tables this size) and rebuilds only on a change.
+    """
+    def __init__(self, source):
+        self._source = source
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._tables = None
+
+    def get(self):
+        source = self._source()
+        fingerprint = repr(source)
+        if fingerprint != self._fingerprint:
+            with self._lock:
+                if fingerprint != self._fingerprint:
+                    self._tables = FactorTables(*source)
+                    self._fingerprint = fingerprint
+        return self._tables
+
+
+def encode(values):
+    """(distinct values, index of each value among them) for a list of strings.
+
+    A dict pass is O(n), where np.unique would sort Python strings.
+    """
+    index = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    return list(index), np.array(codes, dtype=np.intp)
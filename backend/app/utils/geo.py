@@ -0,0 +1,138 @@
+"""Spatial helpers for buyer-relative product search.
+
+GridIndex buckets points into fixed lat/lng cells, so a radius query only
+looks at the cells overlapping the circle's bounding box, and a k-nearest
+query scans rings of cells outward from the buyer until nothing closer can
+remain. Distances are computed with a vectorized haversine over NumPy
+arrays rather than per-point Python math.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Below this many points a brute-force vectorized pass beats cell walking
+_BRUTE_FORCE_POINTS = 4096
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Great-circle distances in km from (lat, lng) to arrays of points"""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlng = np.radians(lngs) - np.radians(lng)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """Row numbers bucketed into cell_degrees x cell_degrees cells"""
+    def __init__(self, rows, lats, lngs, cell_degrees=0.25):
+        self.cell_degrees = cell_degrees
+        cell_i = np.floor(lats / cell_degrees).astype(np.int64)
+        cell_j = np.floor(lngs / cell_degrees).astype(np.int64)
+        order = np.lexsort((cell_j, cell_i))
+        self.rows = rows[order]
+        self.lats = lats[order]
+        self.lngs = lngs[order]
+        self.cells = {}
+        if len(order):
+            cell_i, cell_j = cell_i[order], cell_j[order]
+            boundaries = np.flatnonzero((np.diff(cell_i) != 0) | (np.diff(cell_j) != 0)) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [len(order)]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self.cells[(int(cell_i[start]), int(cell_j[start]))] = (start, end)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees)
+
+    def _gather(self, keys):
+        slices = [self.cells[key] for key in keys if key in self.cells]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in slices])
+
+    def _all(self, lat, lng):
+        return self.rows, haversine_km(lat, lng, self.lats, self.lngs)
+
+    def within(self, lat, lng, radius_km):
+        """(rows, distances) of the points within radius_km of (lat, lng)"""
+        if len(self.rows) <= _BRUTE_FORCE_POINTS:
+            rows, distances = self._all(lat, lng)
+        else:
+            dlat = radius_km / KM_PER_DEGREE
+            widest = max(abs(lat) + dlat, 0)
+            if widest >= 89:
+                rows, distances = self._all(lat, lng)
+            else:
+                dlng = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest)))
+                low_i, low_j = self._cell(lat - dlat, lng - dlng)
+                high_i, high_j = self._cell(lat + dlat, lng + dlng)
+                box = (high_i - low_i + 1) * (high_j - low_j + 1)
+                if box > len(self.cells):
+                    keys = [k for k in self.cells if low_i <= k[0] <= high_i and low_j <= k[1] <= high_j]
+                else:
+                    keys = [(i, j) for i in range(low_i, high_i + 1) for j in range(low_j, high_j + 1)]
+                found = self._gather(keys)
+                rows = self.rows[found]
+                distances = haversine_km(lat, lng, self.lats[found], self.lngs[found])
+        inside = distances <= radius_km
+        return rows[inside], distances[inside]
+
+    def nearest(self, lat, lng, k, accept=None, beyond_km=0.0):
+        """(rows, distances) of a set of points containing the k nearest.
+
+        accept(rows, distances) -> bool mask narrows which points count
+        towards k. Rings of cells are scanned outward until k accepted
+        points lie within the radius the scanned square is known to cover.
+        When only points at least beyond_km away can be accepted (a later
+        page), rings lying wholly inside that radius are skipped.
+        """
+        if len(self.rows) <= _BRUTE_FORCE_POINTS:
+            return self._accepted(*self._all(lat, lng), accept)
+        center_i, center_j = self._cell(lat, lng)
+        rows_parts, distance_parts = [], []
+        found = 0
+        # Every point in ring r is within (r + 1) cell diagonals of the buyer
+        cell_diagonal_km = math.sqrt(2) * self.cell_degrees * KM_PER_DEGREE
+        ring = max(0, math.floor(beyond_km / cell_diagonal_km) - 1)
+        while True:
+            if ring == 0:
+                keys = [(center_i, center_j)]
+            else:
+                top, bottom = center_i - ring, center_i + ring
+                keys = [(i, j) for i in (top, bottom) for j in range(center_j - ring, center_j + ring + 1)]
+                keys += [(i, j) for i in range(top + 1, bottom) for j in (center_j - ring, center_j + ring)]
+            if 8 * ring > len(self.cells):
+                # Rings are now mostly empty; finish with one pass over everything
+                return self._accepted(*self._all(lat, lng), accept)
+            indices = self._gather(keys)
+            if len(indices):
+                rows, distances = self._accepted(
+                    self.rows[indices],
+                    haversine_km(lat, lng, self.lats[indices], self.lngs[indices]),
+                    accept,
+                )
+                rows_parts.append(rows)
+                distance_parts.append(distances)
+                found += len(rows)
+            if found >= k:
+                # Anything outside the scanned square is at least this far
+                edge_lat = min(abs(lat) + (ring + 1) * self.cell_degrees, 90)
+                covered = ring * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+                distances = np.concatenate(distance_parts)
+                if np.partition(distances, k - 1)[k - 1] <= covered:
+                    return np.concatenate(rows_parts), distances
+            ring += 1
+
+    @staticmethod
+    def _accepted(rows, distances, accept):
+        if accept is None:
+            return rows, distances
+        keep = accept(rows, distances)
+        return rows[keep], distances[keep]
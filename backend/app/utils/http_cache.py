@@ -0,0 +1,54 @@
+"""Conditional GET support for cacheable endpoints.
+
+A handler derives a strong ETag from version numbers it already holds and
+calls not_modified() before doing any work, so a client revalidating an
+unchanged resource gets a bodiless 304 without the query or serialization
+ever running.
+"""
+import hashlib
+import os
+
+from fastapi import Response
+
+from . import metrics
+
+# Seconds a client may reuse a catalog response before revalidating it
+CATALOG_CACHE_MAX_AGE = int(os.getenv("CATALOG_CACHE_MAX_AGE", "0"))
+
+
+def make_etag(*parts):
+    """Strong ETag for the values that fully determine a response body"""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match test; it uses weak comparison, so W/"x" matches "x" """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(request, response, etag, max_age=CATALOG_CACHE_MAX_AGE):
+    """Return a 304 Response when the client's copy is current, else None.
+
+    Either way the ETag and Cache-Control headers are set, on the 304 or
+    on ``response`` for the full body the handler goes on to build.
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, must-revalidate",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.incr("http_not_modified")
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,321 @@
+"""Stock reservation for marketplace orders.
+
+An order takes its quantities out of stock atomically per product before it
+is confirmed, so concurrent checkouts of a popular listing cannot oversell:
+
+* DatabaseStock keeps stock documents ({"id", "quantity_kg"}) in the
+  stock collection and takes stock with one conditional update,
+  ``$inc: -q`` guarded by ``quantity_kg >= q``, so the check and the
+  decrement happen in a single server-side operation shared by every
+  worker. The listing's quantity_kg is copied from the stock document
+  after each change, and from all of them on every sweep, so listings
+  served by other workers catch up within RESERVATION_SWEEP_SECONDS.
+* MemoryStock decrements quantity_kg on the in-process listings under
+  striped locks (one lock per hash bucket of product ids).
+
+Reservations of unpaid orders expire; a background sweeper puts their
+stock back. They are kept next to the stock: in a reservations collection
+for DatabaseStock, so any worker can confirm or cancel them and they
+survive a restart, and in a dict for MemoryStock, whose stock is
+per-process anyway. Confirm, cancel and expiry each remove the reservation
+with one conditional delete, so only one of them can win.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+from . import metrics
+
+# auto: a stock collection when MongoDB or SQLite is in use, else in-process
+INVENTORY_BACKEND = os.getenv("INVENTORY_BACKEND", "auto").lower()
+INVENTORY_LOCK_STRIPES = int(os.getenv("INVENTORY_LOCK_STRIPES", "64"))
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "900"))
+RESERVATION_SWEEP_SECONDS = int(os.getenv("RESERVATION_SWEEP_SECONDS", "30"))
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id, requested):
+        super().__init__(f"Not enough stock for product {product_id} ({requested} requested)")
+        self.product_id = product_id
+        self.requested = requested
+
+
+class MemoryStock:
+    """Stock on the in-process catalog listings, guarded by striped locks.
+
+    on_change(product_id) is called after a listing's quantity changed.
+    """
+    def __init__(self, lookup, stripes=INVENTORY_LOCK_STRIPES, on_change=None):
+        self._lookup = lookup
+        self._on_change = on_change
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self.reservations = MemoryReservations()
+
+    def _lock(self, product_id):
+        return self._locks[hash(product_id) % len(self._locks)]
+
+    def take_sync(self, product_id, quantity):
+        listing = self._lookup(product_id)
+        if listing is None:
+            return False
+        with self._lock(product_id):
+            if listing.get("quantity_kg", 0) < quantity:
+                return False
+            listing["quantity_kg"] -= quantity
+        if self._on_change is not None:
+            self._on_change(product_id)
+        return True
+
+    def give_back_sync(self, product_id, quantity):
+        listing = self._lookup(product_id)
+        if listing is not None:
+            with self._lock(product_id):
+                listing["quantity_kg"] = listing.get("quantity_kg", 0) + quantity
+            if self._on_change is not None:
+                self._on_change(product_id)
+
+    async def take(self, product_id, quantity):
+        return self.take_sync(product_id, quantity)
+
+    async def give_back(self, product_id, quantity):
+        self.give_back_sync(product_id, quantity)
+
+    async def refresh(self):
+        """Nothing to do: the listings are the stock"""
+
+
+class DatabaseStock:
+    """Stock documents in the stock collection, changed with guarded $inc.
+
+    on_change(product_id) is called after a listing's quantity_kg was
+    updated from its stock document.
+    """
+    def __init__(self, collection, lookup, reservations_collection, on_change=None):
+        self._collection = collection
+        self._lookup = lookup
+        self._on_change = on_change
+        self.reservations = DatabaseReservations(reservations_collection)
+
+    async def take(self, product_id, quantity, seed=True):
+        result = await self._collection.update_one(
+            {"id": product_id, "quantity_kg": {"$gte": quantity}},
+            {"$inc": {"quantity_kg": -quantity}},
+        )
+        if result.matched_count:
+            await self._sync(product_id)
+            return True
+        if not seed or await self._collection.find_one({"id": product_id}, {"_id": 1}) is not None:
+            return False
+        # First order for this listing: seed its stock document from the catalog
+        listing = self._lookup(product_id)
+        if listing is None:
+            return False
+        try:
+            await self._collection.insert_one({"id": product_id, "quantity_kg": listing.get("quantity_kg", 0)})
+        except DuplicateKeyError:
+            pass
+        return await self.take(product_id, quantity, seed=False)
+
+    async def give_back(self, product_id, quantity):
+        await self._collection.update_one({"id": product_id}, {"$inc": {"quantity_kg": quantity}})
+        await self._sync(product_id)
+
+    async def refresh(self):
+        """Copy every stock level into its listing, picking up other workers' orders"""
+        async for doc in self._collection.find({}, {"id": 1, "quantity_kg": 1}):
+            self._apply(doc)
+
+    async def _sync(self, product_id):
+        if self._lookup(product_id) is None:
+            return
+        doc = await self._collection.find_one({"id": product_id}, {"id": 1, "quantity_kg": 1})
+        if doc is not None:
+            self._apply(doc)
+
+    def _apply(self, doc):
+        listing = self._lookup(doc["id"])
+        if listing is None or listing.get("quantity_kg") == doc["quantity_kg"]:
+            return
+        listing["quantity_kg"] = doc["quantity_kg"]
+        if self._on_change is not None:
+            self._on_change(doc["id"])
+
+
+class MemoryReservations:
+    """Reservations in a process-local dict"""
+    def __init__(self):
+        self._reservations = {}
+
+    async def add(self, reservation):
+        self._reservations[reservation["reservation_id"]] = reservation
+
+    async def remove(self, reservation_id, expires_after=None, expires_before=None):
+        """Remove and return the reservation if its expiry is in range, else None"""
+        reservation = self._reservations.get(reservation_id)
+        if reservation is None or not _expiry_in_range(reservation, expires_after, expires_before):
+            return None
+        return self._reservations.pop(reservation_id)
+
+    async def expired(self, now):
+        return [rid for rid, r in list(self._reservations.items()) if r["expires_at"] < now]
+
+
+class DatabaseReservations:
+    """Reservations as documents keyed by reservation id, shared by every worker"""
+    def __init__(self, collection):
+        self._collection = collection
+
+    async def add(self, reservation):
+        await self._collection.insert_one({
+            "_id": reservation["reservation_id"],
+            "items": [list(item) for item in reservation["items"]],
+            "expires_at": reservation["expires_at"],
+        })
+
+    async def remove(self, reservation_id, expires_after=None, expires_before=None):
+        """Remove and return the reservation if its expiry is in range, else None"""
+        query = {"_id": reservation_id}
+        expiry = {}
+        if expires_after is not None:
+            expiry["$gte"] = expires_after
+        if expires_before is not None:
+            expiry["$lt"] = expires_before
+        if expiry:
+            query["expires_at"] = expiry
+        doc = await self._collection.find_one(query)
+        # Reservations never change once written, so the document read above
+        # is the one deleted here, if this caller is the one to delete it.
+        if doc is None or not (await self._collection.delete_one(query)).deleted_count:
+            return None
+        return {"reservation_id": doc["_id"], "items": doc["items"], "expires_at": doc["expires_at"]}
+
+    async def expired(self, now):
+        docs = await self._collection.find({"expires_at": {"$lt": now}}, {"_id": 1}).to_list(None)
+        return [doc["_id"] for doc in docs]
+
+
+def _expiry_in_range(reservation, expires_after, expires_before):
+    if expires_after is not None and reservation["expires_at"] < expires_after:
+        return False
+    return expires_before is None or reservation["expires_at"] < expires_before
+
+
+class ReservationBook:
+    """Holds the stock taken by unpaid orders until they are paid or expire"""
+    def __init__(self, stock, ttl_seconds=RESERVATION_TTL_SECONDS):
+        self._stock = stock
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def stock(self):
+        return self._stock() if callable(self._stock) else self._stock
+
+    async def reserve(self, items):
+        """Take stock for [(product_id, quantity), ...] all or nothing.
+
+        Returns the reservation dict; raises OutOfStock and puts back what
+        was already taken when any product is short. Every quantity must be
+        a positive int; ValueError is raised before any stock is touched
+        otherwise.
+        """
+        totals = {}
+        for product_id, quantity in items:
+            if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+                raise ValueError(f"Quantity for product {product_id} must be a positive integer")
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        stock = self.stock
+        taken = []
+        for product_id, quantity in totals.items():
+            if not await stock.take(product_id, quantity):
+                for taken_id, taken_quantity in reversed(taken):
+                    await stock.give_back(taken_id, taken_quantity)
+                metrics.incr("inventory_out_of_stock")
+                raise OutOfStock(product_id, quantity)
+            taken.append((product_id, quantity))
+        reservation = {
+            "reservation_id": uuid.uuid4().hex,
+            "items": taken,
+            "expires_at": time.time() + self.ttl_seconds,
+        }
+        try:
+            await stock.reservations.add(reservation)
+        except Exception:
+            for taken_id, taken_quantity in reversed(taken):
+                await stock.give_back(taken_id, taken_quantity)
+            raise
+        metrics.incr("inventory_reservations")
+        return reservation
+
+    async def confirm(self, reservation_id):
+        """Mark a reservation paid; its stock stays taken"""
+        if await self.stock.reservations.remove(reservation_id, expires_after=time.time()) is None:
+            return False
+        metrics.incr("inventory_reservations_confirmed")
+        return True
+
+    async def release(self, reservation_id, expires_before=None):
+        """Cancel a reservation and put its stock back"""
+        stock = self.stock
+        reservation = await stock.reservations.remove(reservation_id, expires_before=expires_before)
+        if reservation is None:
+            return False
+        for product_id, quantity in reservation["items"]:
+            await stock.give_back(product_id, quantity)
+        return True
+
+    async def sweep(self, now=None):
+        """Release every expired reservation; returns how many were released"""
+        now = time.time() if now is None else now
+        released = 0
+        for reservation_id in await self.stock.reservations.expired(now):
+            # Re-checked on removal: it may have been paid or swept meanwhile
+            if await self.release(reservation_id, expires_before=now):
+                released += 1
+        if released:
+            metrics.incr("inventory_reservations_expired", released)
+        return released
+
+    async def run_sweeper(self, interval=RESERVATION_SWEEP_SECONDS):
+        """Sweep expired reservations forever; run as a background task"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+                await self.stock.refresh()
+            except Exception as e:
+                print(f"⚠️ Reservation sweep failed: {e}")
+
+
+def select_stock(lookup, on_change=None):
+    """Return a zero-argument callable giving the stock store to use.
+
+    The choice waits for the first order, because the database is only
+    known after startup. on_change(product_id) is called whenever a
+    listing's quantity_kg changes.
+    """
+    chosen = []
+
+    def stock():
+        if not chosen:
+            database = None
+            if INVENTORY_BACKEND in ("auto", "database"):
+                # Imported here so this module stays importable on its own
+                from app.database import get_database
+                database = get_database()
+                # The JSON mock database only holds users
+                if not hasattr(database, "products"):
+                    database = None
+                if database is None and INVENTORY_BACKEND == "database":
+                    raise RuntimeError("INVENTORY_BACKEND=database needs a MongoDB or SQLite database")
+            if database is not None:
+                chosen.append(DatabaseStock(
+                    database["stock"], lookup, database["reservations"], on_change=on_change
+                ))
+            else:
+                chosen.append(MemoryStock(lookup, on_change=on_change))
+        return chosen[0]
+    return stock
@@ -0,0 +1,366 @@
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so only one process may write a store
+    fcntl = None
+
+
+class JournalStore:
+    """Append-only journal + snapshot storage used by the mock database.
+
+    Every mutation is appended to ``<path>.journal`` as one JSON line, so a
+    write costs O(1) regardless of how many documents are stored. Appended
+    lines are fsynced together once per ``fsync_interval`` seconds (0 means
+    fsync on every write). After ``compact_every`` records (or as many
+    records as there are documents, whichever is larger) the journal is
+    sealed and folded into the ``<path>`` snapshot on a background thread.
+    On load the snapshot is read and any sealed/active journal is replayed,
+    ignoring a torn last line left behind by a crash.
+
+    Several processes may share one store. Appends hold a shared flock on
+    ``<path>.journal.lock`` and sealing the journal takes it exclusively,
+    so no record lands in a journal that is being sealed. Compaction and
+    load hold ``<path>.lock`` exclusively, and compaction folds the sealed
+    journal into the snapshot on disk rather than this process's copy of
+    the data, so other writers' records survive it.
+
+    The store remembers which snapshot it loaded and how far into the
+    journal it has read, counting its own appends. refresh() then applies
+    just the lines other writers appended since; only a snapshot rewritten
+    by another process's compaction needs a full load().
+    """
+
+    def __init__(self, path, fsync_interval=0.05, compact_every=10000):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.sealed_path = f"{path}.journal.compacting"
+        self.lock_path = f"{path}.lock"
+        self.journal_lock_path = f"{path}.journal.lock"
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.data = {}
+        self._lock = threading.RLock()
+        self._fh = None
+        self._journal_lock = None
+        self._records = 0
+        self._sync_timer = None
+        self._compactor = None
+        # What this process has seen: the snapshot's stat signature, and the
+        # active journal's inode, bytes applied and size counting our own
+        # appends. A journal inode of None means any journal found is new.
+        self._snapshot_signature = None
+        self._journal_ino = None
+        self._journal_offset = 0
+        self._journal_size = 0
+
+    def load(self):
+        """Load the snapshot, replay journals and return the recovered data"""
+        with self._lock:
+            if self._fh is not None:
+                self.flush()
+                self._fh.close()
+                self._fh = None
+            with _flock(self.lock_path), _flock(self.journal_lock_path):
+                self.data = self._read_snapshot()
+                sealed, _ = self._replay(self.sealed_path)
+                self._records, offset = self._replay(self.journal_path)
+                if sealed or os.path.exists(self.sealed_path):
+                    # A compaction was interrupted: fold everything into a
+                    # fresh snapshot before new records go to the journal.
+                    self._write_snapshot(dict(self.data))
+                    self._remove(self.sealed_path)
+                    self._remove(self.journal_path)
+                    self._records = offset = 0
+                self._snapshot_signature = _stat_signature(self.path)
+                journal = _stat(self.journal_path)
+                self._journal_ino = journal.st_ino if journal is not None else None
+                self._journal_offset = self._journal_size = offset
+            return self.data
+
+    def changed_on_disk(self):
+        """True if another writer touched the snapshot or journal since we looked"""
+        with self._lock:
+            if self._compacting():
+                # Our compaction rewrites both; look again once it is done
+                return False
+            if _stat_signature(self.path) != self._snapshot_signature:
+                return True
+            journal = _stat(self.journal_path)
+            if journal is None:
+                return self._journal_ino is not None
+            return journal.st_ino != self._journal_ino or journal.st_size != self._journal_size
+
+    def refresh(self):
+        """Apply the journal lines other writers appended since we last looked.
+
+        Returns {key: document before the change, or None} for every key
+        that changed, or None when the snapshot was rewritten by another
+        process and load() is needed instead.
+        """
+        with self._lock:
+            if self._compacting():
+                return {}
+            if self._journal_lock is None:
+                self._journal_lock = open(self.journal_lock_path, "a")
+            with _flock(self._journal_lock, shared=True):
+                if _stat_signature(self.path) != self._snapshot_signature:
+                    return None
+                journal = _stat(self.journal_path)
+                if journal is None:
+                    return None if self._journal_ino is not None else {}
+                if self._journal_ino is None:
+                    self._journal_ino = journal.st_ino
+                    self._journal_offset = 0
+                elif journal.st_ino != self._journal_ino:
+                    return None
+                previous = {}
+                records, offset = self._read_records(self.journal_path, self._journal_offset)
+                for record in records:
+                    key = record["key"]
+                    if key not in previous:
+                        previous[key] = self.data.get(key)
+                    self._apply(self.data, record)
+                # Our own appends are in the file too, so everything up to
+                # here has now been seen.
+                self._journal_offset = self._journal_size = offset
+                return previous
+
+    def put(self, key, doc):
+        """Store doc under key and journal the full document"""
+        with self._lock:
+            self.data[key] = doc
+            self._append({"op": "put", "key": key, "doc": doc})
+
+    def delete(self, key):
+        """Remove key and journal the deletion"""
+        with self._lock:
+            self.data.pop(key, None)
+            self._append({"op": "del", "key": key})
+
+    def flush(self):
+        """Flush buffered journal records and fsync them to disk"""
+        with self._lock:
+            self._sync_timer = None
+            if self._fh is not None and not self._fh.closed:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+
+    def compact(self, wait=False):
+        """Seal the journal and rewrite the snapshot in the background"""
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                compactor = self._compactor
+            else:
+                self.flush()
+                self._records = 0
+                compactor = threading.Thread(target=self._run_compaction, daemon=True)
+                self._compactor = compactor
+                compactor.start()
+        if wait:
+            compactor.join()
+
+    def close(self):
+        """Flush pending records and wait for any running compaction"""
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+            self.flush()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            if self._journal_lock is not None:
+                self._journal_lock.close()
+                self._journal_lock = None
+            compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def _compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def _append(self, record):
+        line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+        if self._journal_lock is None:
+            self._journal_lock = open(self.journal_lock_path, "a")
+        with _flock(self._journal_lock, shared=True):
+            if self._fh is not None and self._journal_replaced():
+                # Sealed by a compaction since we opened it
+                self.flush()
+                self._fh.close()
+                self._fh = None
+            if self._fh is None:
+                self._fh = open(self.journal_path, "ab")
+                if self._journal_ino is None:
+                    self._journal_ino = os.fstat(self._fh.fileno()).st_ino
+            self._fh.write(line)
+            # Hand the record to the OS right away (a process crash can't
+            # lose it); only the fsync is batched.
+            self._fh.flush()
+            self._journal_size += len(line)
+        self._records += 1
+        if self.fsync_interval <= 0:
+            self.flush()
+        elif self._sync_timer is None:
+            self._sync_timer = threading.Timer(self.fsync_interval, self.flush)
+            self._sync_timer.daemon = True
+            self._sync_timer.start()
+        # Compact once the journal is as large as the snapshot so rewrite
+        # cost stays amortised O(1) per write as the store grows.
+        if self.compact_every and self._records >= max(self.compact_every, len(self.data)):
+            self.compact()
+
+    def _journal_replaced(self):
+        try:
+            return os.stat(self.journal_path).st_ino != os.fstat(self._fh.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _seal_journal(self):
+        if not os.path.exists(self.sealed_path):
+            os.replace(self.journal_path, self.sealed_path)
+            return
+        # An earlier compaction failed; keep its records ahead of ours
+        with open(self.sealed_path, "a", encoding="utf-8") as dst, \
+                open(self.journal_path, "r", encoding="utf-8") as src:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.journal_path)
+
+    def _run_compaction(self):
+        try:
+            with _flock(self.lock_path):
+                with _flock(self.journal_lock_path):
+                    # Appenders wait on the journal lock, so the fields they
+                    # update are stable here.
+                    journal = _stat(self.journal_path)
+                    if journal is None:
+                        seen_all = self._journal_ino is None
+                    else:
+                        seen_all = (journal.st_ino == self._journal_ino
+                                    and journal.st_size == self._journal_size)
+                    seen_all = (seen_all and not os.path.exists(self.sealed_path)
+                                and _stat_signature(self.path) == self._snapshot_signature)
+                    if journal is not None:
+                        self._seal_journal()
+                    self._journal_ino = None
+                    self._journal_offset = self._journal_size = 0
+                # Fold what is on disk, which includes other writers' records
+                snapshot = self._read_snapshot()
+                self._replay(self.sealed_path, snapshot)
+                self._write_snapshot(snapshot)
+                self._remove(self.sealed_path)
+                if seen_all:
+                    # Nothing in the new snapshot is news to this process;
+                    # otherwise the stale signature makes the next check reload.
+                    self._snapshot_signature = _stat_signature(self.path)
+        except Exception as e:
+            # The sealed journal is kept and replayed on the next load
+            print(f"⚠️ Journal compaction failed for {self.path}: {e}")
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write_snapshot(self, snapshot):
+        os.replace(self._write_snapshot_tmp(snapshot), self.path)
+
+    def _write_snapshot_tmp(self, snapshot):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path
+
+    def _replay(self, journal_path, data=None):
+        """Apply journal records to data (self.data by default).
+
+        Returns (records applied, bytes read). A torn last line left by a
+        crash is truncated away; callers hold the journal lock exclusively.
+        """
+        if data is None:
+            data = self.data
+        records, offset = self._read_records(journal_path, truncate=True)
+        for record in records:
+            self._apply(data, record)
+        return len(records), offset
+
+    @staticmethod
+    def _read_records(journal_path, offset=0, truncate=False):
+        """Parse journal records from offset, returning (records, offset reached)"""
+        records = []
+        try:
+            f = open(journal_path, "rb")
+        except OSError:
+            return records, 0
+        with f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    records.append(json.loads(line))
+                except ValueError:
+                    if truncate:
+                        # Torn write from a crash; drop it so later appends
+                        # don't land behind an unreadable line.
+                        f.close()
+                        os.truncate(journal_path, offset)
+                    # Otherwise it may be a line another writer is still
+                    # appending; it is read next time.
+                    break
+                offset += len(line)
+        return records, offset
+
+    @staticmethod
+    def _apply(data, record):
+        if record.get("op") == "put":
+            data[record["key"]] = record["doc"]
+        elif record.get("op") == "del":
+            data.pop(record["key"], None)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _stat_signature(path):
+    """(inode, mtime, size) of path, or None when it does not exist"""
+    st = _stat(path)
+    return None if st is None else (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+@contextmanager
+def _flock(lock, shared=False):
+    """Hold an flock on lock, an open file or a path to open for the duration"""
+    if fcntl is None:
+        yield
+        return
+    fh = open(lock, "a") if isinstance(lock, str) else lock
+    try:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    finally:
+        if fh is not lock:
+            fh.close()
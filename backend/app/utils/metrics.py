@@ -0,0 +1,59 @@
+import threading
+
+# Process-local counters, gauges and timings, served as JSON at /metrics
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def incr(name, amount=1):
+    """Increase a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    """Record the current value of a gauge"""
+    with _lock:
+        _gauges[name] = value
+
+
+def adjust_gauge(name, delta):
+    """Move a gauge up or down by delta"""
+    with _lock:
+        _gauges[name] = _gauges.get(name, 0) + delta
+
+
+def observe(name, seconds):
+    """Record one timing sample in seconds"""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {"count": 0, "total": 0.0, "max": 0.0}
+        timing["count"] += 1
+        timing["total"] += seconds
+        if seconds > timing["max"]:
+            timing["max"] = seconds
+
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot():
+    """Return all metrics as a JSON-friendly dict"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {
+                name: {
+                    "count": t["count"],
+                    "avg_ms": round(t["total"] / t["count"] * 1000, 3) if t["count"] else 0,
+                    "max_ms": round(t["max"] * 1000, 3),
+                }
+                for name, t in _timings.items()
+            },
+        }
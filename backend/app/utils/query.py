@@ -0,0 +1,280 @@
+"""Subset of MongoDB query/update semantics for the fallback database.
+
+Queries are compiled once into matcher closures (and cached per distinct
+query), so matching a document is a chain of plain function calls instead
+of re-interpreting the query dict for every document.
+"""
+import heapq
+from datetime import datetime
+from functools import lru_cache
+
+from bson import ObjectId
+
+_MISSING = object()
+
+
+def _norm(value):
+    # Documents loaded from disk carry str ids, freshly inserted ones ObjectIds
+    return str(value) if isinstance(value, ObjectId) else value
+
+
+def _compare(op):
+    def matches(value, target):
+        if value is _MISSING or value is None:
+            return False
+        try:
+            return op(_norm(value), target)
+        except TypeError:
+            return False
+    return matches
+
+
+_COMPARISONS = {
+    "$gt": _compare(lambda a, b: a > b),
+    "$gte": _compare(lambda a, b: a >= b),
+    "$lt": _compare(lambda a, b: a < b),
+    "$lte": _compare(lambda a, b: a <= b),
+}
+
+
+def _eq(value, target):
+    if isinstance(value, list) and not isinstance(target, list):
+        return any(_norm(v) == target for v in value)
+    if value is _MISSING:
+        return target is None
+    return _norm(value) == target
+
+
+def _hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+
+def _compile_field(field, condition):
+    """Return a predicate on one document field"""
+    is_operator_dict = (
+        isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)
+    )
+    if not is_operator_dict:
+        target = _norm(condition)
+        return lambda doc: _eq(doc.get(field, _MISSING), target)
+
+    checks = []
+    for op, arg in condition.items():
+        if op == "$eq":
+            target = _norm(arg)
+            checks.append(lambda v, t=target: _eq(v, t))
+        elif op == "$ne":
+            target = _norm(arg)
+            checks.append(lambda v, t=target: not _eq(v, t))
+        elif op in ("$in", "$nin"):
+            values = [_norm(a) for a in arg]
+            lookup = set(values) if all(_hashable(v) for v in values) else None
+            if lookup is not None:
+                def member(v, s=lookup):
+                    v = None if v is _MISSING else _norm(v)
+                    return _hashable(v) and v in s
+            else:
+                def member(v, l=values):
+                    return (None if v is _MISSING else _norm(v)) in l
+            checks.append(member if op == "$in" else (lambda v, m=member: not m(v)))
+        elif op in _COMPARISONS:
+            compare = _COMPARISONS[op]
+            checks.append(lambda v, c=compare, t=_norm(arg): c(v, t))
+        elif op == "$exists":
+            checks.append(lambda v, want=bool(arg): (v is not _MISSING) == want)
+        else:
+            raise ValueError(f"Unsupported query operator: {op}")
+
+    if len(checks) == 1:
+        check = checks[0]
+        return lambda doc: check(doc.get(field, _MISSING))
+    return lambda doc: all(c(doc.get(field, _MISSING)) for c in checks)
+
+
+def _compile(query):
+    predicates = []
+    for key, condition in query.items():
+        if key == "$or":
+            branches = [_compile(q) for q in condition]
+            predicates.append(lambda doc, b=branches: any(p(doc) for p in b))
+        elif key == "$and":
+            branches = [_compile(q) for q in condition]
+            predicates.append(lambda doc, b=branches: all(p(doc) for p in b))
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported query operator: {key}")
+        else:
+            predicates.append(_compile_field(key, condition))
+    if not predicates:
+        return lambda doc: True
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda doc: all(p(doc) for p in predicates)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return ("d", tuple((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return ("l", tuple(_freeze(v) for v in value))
+    if isinstance(value, ObjectId):
+        return ("o", str(value))
+    hash(value)
+    return value
+
+
+def _thaw(frozen):
+    if isinstance(frozen, tuple) and len(frozen) == 2 and frozen[0] in ("d", "l", "o"):
+        tag, body = frozen
+        if tag == "d":
+            return {k: _thaw(v) for k, v in body}
+        if tag == "l":
+            return [_thaw(v) for v in body]
+        return body
+    return frozen
+
+
+@lru_cache(maxsize=512)
+def _compile_frozen(frozen):
+    return _compile(_thaw(frozen))
+
+
+def compile_query(query):
+    """Compile a query dict into a ``matcher(doc) -> bool`` closure"""
+    if not query:
+        return lambda doc: True
+    try:
+        frozen = _freeze(query)
+    except TypeError:
+        return _compile(query)
+    return _compile_frozen(frozen)
+
+
+def index_lookups(query, indexed_fields):
+    """Index probes that narrow query without a full scan.
+
+    Returns a list of ``(field, values)`` probes; the union of the index
+    buckets they hit contains every matching document. Returns None when no
+    indexed predicate narrows the query.
+    """
+    best = None
+    for field, condition in query.items():
+        if field not in indexed_fields:
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if set(condition) == {"$in"}:
+                values = [_norm(v) for v in condition["$in"]]
+            elif set(condition) == {"$eq"}:
+                values = [_norm(condition["$eq"])]
+            else:
+                continue
+        else:
+            values = [_norm(condition)]
+        if not all(_hashable(v) for v in values):
+            continue
+        if best is None or len(values) < len(best[0][1]):
+            best = [(field, values)]
+    if best is not None:
+        return best
+    if "$or" in query:
+        probes = []
+        for branch in query["$or"]:
+            branch_probes = index_lookups(branch, indexed_fields)
+            if branch_probes is None:
+                return None
+            probes.extend(branch_probes)
+        return probes
+    return None
+
+
+def apply_update(doc, update):
+    """Return a new document with $set/$inc/$unset applied"""
+    if not update or not all(k.startswith("$") for k in update):
+        raise ValueError("update_one requires update operators such as $set")
+    updated = dict(doc)
+    for op, fields in update.items():
+        if op == "$set":
+            updated.update(fields)
+        elif op == "$inc":
+            for field, amount in fields.items():
+                current = updated.get(field, 0)
+                if not isinstance(current, (int, float)):
+                    raise ValueError(f"Cannot apply $inc to non-numeric field {field}")
+                updated[field] = current + amount
+        elif op == "$unset":
+            for field in fields:
+                updated.pop(field, None)
+        else:
+            raise ValueError(f"Unsupported update operator: {op}")
+    return updated
+
+
+def upsert_document(query, update):
+    """Build the document inserted by an upsert"""
+    seed = {
+        k: v for k, v in query.items()
+        if not k.startswith("$") and not (isinstance(v, dict) and any(x.startswith("$") for x in v))
+    }
+    return apply_update(seed, update)
+
+
+def project(doc, projection):
+    """Apply an inclusion ({field: 1}) or exclusion ({field: 0}) projection"""
+    if not projection:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and any(fields.values()):
+        result = {k: doc[k] for k in fields if fields[k] and k in doc}
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    result = {k: v for k, v in doc.items() if k not in fields}
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+_TYPE_ORDER = ((type(None), 0), (bool, 8), (int, 1), (float, 1), (str, 2),
+               (dict, 3), (list, 4), (ObjectId, 7), (datetime, 9))
+
+
+def _sort_value(value):
+    # Mongo orders mixed types by BSON type, so never compare across types
+    for kind, rank in _TYPE_ORDER:
+        if isinstance(value, kind):
+            return (rank, str(value) if kind in (dict, list) else value)
+    return (10, str(value))
+
+
+def normalize_sort(sort, direction=None):
+    """Accept 'field', ('field', dir) or [('field', dir), ...]"""
+    if sort is None:
+        return []
+    if isinstance(sort, str):
+        return [(sort, direction or 1)]
+    if isinstance(sort, tuple) and len(sort) == 2 and isinstance(sort[0], str):
+        return [sort]
+    return list(sort)
+
+
+def sort_documents(docs, sort, limit=0):
+    """Sort docs by a normalized sort spec; top-k via a heap when limited"""
+    if not sort:
+        return list(docs) if not limit else list(docs)[:limit]
+    if len(sort) == 1:
+        field, direction = sort[0]
+        key = lambda d: _sort_value(_norm(d.get(field)))
+        if limit:
+            pick = heapq.nlargest if direction < 0 else heapq.nsmallest
+            return pick(limit, docs, key=key)
+        return sorted(docs, key=key, reverse=direction < 0)
+    result = list(docs)
+    for field, direction in reversed(sort):
+        result.sort(key=lambda d, f=field: _sort_value(_norm(d.get(f))), reverse=direction < 0)
+    return result[:limit] if limit else result
@@ -0,0 +1,161 @@
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
+from fastapi import HTTPException, Request
+
+from app.utils import metrics
+
+# Limits for /auth/login and /auth/register: per client IP, per username from
+# one IP, and a looser one per username across all IPs. Keying the tight
+# username limit on the IP too means a stranger who knows a username cannot
+# use up its bucket and lock the owner out.
+# AUTH_RATE_LIMIT_STORE=sqlite shares buckets between workers on one host.
+AUTH_RATE_LIMIT_STORE = os.getenv("AUTH_RATE_LIMIT_STORE", "memory").lower()
+AUTH_RATE_LIMIT_SQLITE_PATH = os.getenv("AUTH_RATE_LIMIT_SQLITE_PATH", "ratelimit.db")
+AUTH_RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("AUTH_RATE_LIMIT_IP_PER_MINUTE", "30"))
+AUTH_RATE_LIMIT_IP_BURST = int(os.getenv("AUTH_RATE_LIMIT_IP_BURST", "10"))
+AUTH_RATE_LIMIT_USER_PER_MINUTE = float(os.getenv("AUTH_RATE_LIMIT_USER_PER_MINUTE", "10"))
+AUTH_RATE_LIMIT_USER_BURST = int(os.getenv("AUTH_RATE_LIMIT_USER_BURST", "5"))
+AUTH_RATE_LIMIT_ACCOUNT_PER_MINUTE = float(os.getenv("AUTH_RATE_LIMIT_ACCOUNT_PER_MINUTE", "60"))
+AUTH_RATE_LIMIT_ACCOUNT_BURST = int(os.getenv("AUTH_RATE_LIMIT_ACCOUNT_BURST", "30"))
+# Only honour X-Forwarded-For behind a trusted reverse proxy
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+
+class MemoryBucketStore:
+    """Token buckets for one worker process"""
+    def __init__(self, max_keys=100000, idle_seconds=3600):
+        # An evicted idle bucket would have refilled anyway
+        self._buckets = TTLCache(maxsize=max_keys, ttl=idle_seconds)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, allowed, retry_after = _refill_and_take(tokens, updated, rate, burst, now)
+            self._buckets[key] = (tokens, now)
+            return allowed, retry_after
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file shared by every worker on the host"""
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit")
+        self._conn = self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=1000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+        )
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, allowed, retry_after = _refill_and_take(tokens, updated, rate, burst, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    async def take_async(self, key, rate, burst, now):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.take, key, rate, burst, now)
+
+
+def _refill_and_take(tokens, updated, rate, burst, now):
+    """Refill at rate tokens/sec up to burst, then try to take one"""
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, True, 0
+    return tokens, False, math.ceil((1 - tokens) / rate)
+
+
+class TokenBucketLimiter:
+    """Allows ``burst`` requests at once and ``per_minute`` sustained per key"""
+    def __init__(self, name, per_minute, burst, store):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.store = store
+
+    async def hit(self, key):
+        """Take a token for key; returns (allowed, retry_after_seconds)"""
+        if self.rate <= 0:
+            return True, 0
+        bucket_key = f"{self.name}:{key}"
+        now = time.time()
+        if isinstance(self.store, SQLiteBucketStore):
+            return await self.store.take_async(bucket_key, self.rate, self.burst, now)
+        return self.store.take(bucket_key, self.rate, self.burst, now)
+
+
+_auth_limiters = None
+
+
+def _get_auth_limiters():
+    global _auth_limiters
+    if _auth_limiters is None:
+        if AUTH_RATE_LIMIT_STORE == "sqlite":
+            store = SQLiteBucketStore(AUTH_RATE_LIMIT_SQLITE_PATH)
+        else:
+            store = MemoryBucketStore()
+        _auth_limiters = (
+            TokenBucketLimiter("ip", AUTH_RATE_LIMIT_IP_PER_MINUTE, AUTH_RATE_LIMIT_IP_BURST, store),
+            TokenBucketLimiter("user", AUTH_RATE_LIMIT_USER_PER_MINUTE, AUTH_RATE_LIMIT_USER_BURST, store),
+            TokenBucketLimiter(
+                "account", AUTH_RATE_LIMIT_ACCOUNT_PER_MINUTE, AUTH_RATE_LIMIT_ACCOUNT_BURST, store
+            ),
+        )
+    return _auth_limiters
+
+
+def client_ip(request: Request):
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def enforce_auth_rate_limit(request: Request, username: str = None):
+    """Raise 429 when the client IP, the username from that IP, or the
+    username overall is over its auth limit.
+
+    Called before any password hashing so rejected requests stay cheap.
+    """
+    ip_limiter, user_limiter, account_limiter = _get_auth_limiters()
+    ip = client_ip(request)
+    checks = [(ip_limiter, ip)]
+    if username:
+        username = username.strip().lower()
+        checks.append((user_limiter, f"{ip}:{username}"))
+        checks.append((account_limiter, username))
+    for limiter, key in checks:
+        allowed, retry_after = await limiter.hit(key)
+        if not allowed:
+            metrics.incr(f"auth_rate_limited_{limiter.name}")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts. Please wait and try again.",
+                headers={"Retry-After": str(retry_after)},
+            )
+    metrics.incr("auth_rate_limit_allowed")
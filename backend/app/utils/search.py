@@ -0,0 +1,174 @@
+"""Full-text search over product listings.
+
+An inverted index maps each term to the documents containing it, and a
+trigram index over the vocabulary finds terms that a query word is a
+prefix or substring of, or is a likely misspelling of ("tomatos" ->
+"tomatoes"). Matches are ranked with BM25. Documents are added, replaced
+and removed one at a time, so the index never needs a full rebuild.
+"""
+import math
+import re
+import threading
+from collections import Counter
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase alphanumeric words of text"""
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+def _trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TextIndex:
+    """BM25 inverted index with trigram-based prefix, infix and fuzzy lookup.
+
+    ``fields`` maps document fields to a term-frequency weight, so a word
+    in the product name counts more than one in the description. A query
+    matches a document when every query word matches one of its terms
+    exactly, as a prefix/substring, or within ``min_similarity`` (Dice
+    coefficient over trigrams) when the word is not in the vocabulary.
+    Words of one or two letters only match as a prefix/substring.
+    """
+    def __init__(self, fields=(("name", 2), ("description", 1)), k1=1.2, b=0.75,
+                 min_similarity=0.5):
+        self.fields = fields
+        self.k1 = k1
+        self.b = b
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._postings = {}        # term -> {doc_id: weighted tf}
+        self._doc_terms = {}       # doc_id -> {term: weighted tf}
+        self._doc_length = {}
+        self._total_length = 0
+        self._term_trigrams = {}   # trigram -> set of terms
+        self._trigram_count = {}   # term -> number of distinct trigrams
+        self._expansions = {}      # query word -> {term: weight}
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, doc_id, doc):
+        """Index doc under doc_id, replacing any previous version"""
+        terms = Counter()
+        for field, weight in self.fields:
+            for token in tokenize(doc.get(field)):
+                terms[token] += weight
+        with self._lock:
+            self._remove(doc_id)
+            self._doc_terms[doc_id] = dict(terms)
+            length = sum(terms.values())
+            self._doc_length[doc_id] = length
+            self._total_length += length
+            for term, tf in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._add_term(term)
+                postings[doc_id] = tf
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_length.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                self._drop_term(term)
+
+    def _add_term(self, term):
+        grams = _trigrams(term)
+        for gram in grams:
+            self._term_trigrams.setdefault(gram, set()).add(term)
+        self._trigram_count[term] = len(grams)
+        self._expansions.clear()
+
+    def _drop_term(self, term):
+        for gram in _trigrams(term):
+            terms = self._term_trigrams[gram]
+            terms.discard(term)
+            if not terms:
+                del self._term_trigrams[gram]
+        del self._trigram_count[term]
+        self._expansions.clear()
+
+    def _expand(self, word):
+        """Vocabulary terms word should match, with a weight in (0, 1]"""
+        cached = self._expansions.get(word)
+        if cached is not None:
+            return cached
+        expansions = {}
+        known = word in self._postings
+        if known:
+            expansions[word] = 1.0
+        if len(word) >= 3:
+            grams = _trigrams(word)
+            # Every term containing word shares all of its inner trigrams
+            inner = len(word) - 2
+            shared = Counter()
+            for gram in grams:
+                for term in self._term_trigrams.get(gram, ()):
+                    shared[term] += 1
+            for term, count in shared.items():
+                if term == word:
+                    continue
+                if count >= inner and word in term:
+                    expansions[term] = 0.8 if term.startswith(word) else 0.6
+                elif not known:
+                    similarity = 2 * count / (len(grams) + self._trigram_count[term])
+                    if similarity >= self.min_similarity:
+                        expansions[term] = similarity * 0.9
+        else:
+            # Too short for trigrams; scan the vocabulary (cached below)
+            for term in self._postings:
+                if term != word and word in term:
+                    expansions[term] = 0.8 if term.startswith(word) else 0.6
+        if len(self._expansions) > 10000:
+            self._expansions.clear()
+        self._expansions[word] = expansions
+        return expansions
+
+    def search(self, query):
+        """Return {doc_id: BM25 score} for documents matching every query word"""
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return {}
+        with self._lock:
+            n = len(self._doc_terms)
+            if not n:
+                return {}
+            average_length = self._total_length / n
+            per_word = []
+            for word in words:
+                scores = {}
+                for term, weight in self._expand(word).items():
+                    postings = self._postings[term]
+                    df = len(postings)
+                    idf = math.log(1 + (n - df + 0.5) / (df + 0.5)) * weight
+                    for doc_id, tf in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self._doc_length[doc_id] / average_length)
+                        score = idf * tf * (self.k1 + 1) / (tf + norm)
+                        # A word counts once per document, via its best term
+                        if score > scores.get(doc_id, 0):
+                            scores[doc_id] = score
+                if not scores:
+                    return {}
+                per_word.append(scores)
+        per_word.sort(key=len)
+        result = per_word[0]
+        for scores in per_word[1:]:
+            result = {doc_id: s + scores[doc_id] for doc_id, s in result.items() if doc_id in scores}
+            if not result:
+                break
+        return result
@@ -0,0 +1,339 @@
+"""Current-weather lookups for the advisory endpoints.
+
+OpenWeatherProvider calls the OpenWeatherMap API over one pooled
+httpx.AsyncClient (keep-alive connections, connect/read timeouts, retries
+with backoff on timeouts, 429 and 5xx). Without an API key the
+SimulatedWeatherProvider produces seasonal values for India, as the
+advisory service always did in demo mode.
+
+WeatherService puts a TTL cache in front of the provider and coalesces
+concurrent misses: while one lookup for a city is in flight, other callers
+for that city await the same task instead of calling upstream again.
+Expired readings are served stale while they refresh in the background,
+and the most requested cities are refreshed before they expire, so users
+rarely wait on upstream.
+
+A location is a city name or a (lat, lng) tuple. Point WEATHER_BASE_URL
+at a local stub server, or call set_provider(), to run without the real
+API.
+"""
+import asyncio
+import datetime
+import os
+import random
+import time
+from collections import Counter
+
+import httpx
+
+from . import metrics
+
+WEATHER_API_KEY = os.getenv("WEATHER_API_KEY", "demo_key")
+WEATHER_BASE_URL = os.getenv("WEATHER_BASE_URL", "http://api.openweathermap.org/data/2.5")
+# auto: openweathermap when WEATHER_API_KEY is set, else simulated
+WEATHER_PROVIDER = os.getenv("WEATHER_PROVIDER", "auto").lower()
+WEATHER_TIMEOUT_SECONDS = float(os.getenv("WEATHER_TIMEOUT_SECONDS", "5"))
+WEATHER_RETRIES = int(os.getenv("WEATHER_RETRIES", "2"))
+WEATHER_MAX_CONNECTIONS = int(os.getenv("WEATHER_MAX_CONNECTIONS", "20"))
+# Readings are fresh for WEATHER_TTL_SECONDS (less up to WEATHER_TTL_JITTER
+# of it), then served stale while a refresh runs, for at most
+# WEATHER_MAX_STALE_SECONDS after they were fetched
+WEATHER_TTL_SECONDS = float(os.getenv("WEATHER_TTL_SECONDS", "300"))
+WEATHER_MAX_STALE_SECONDS = float(os.getenv("WEATHER_MAX_STALE_SECONDS", "1800"))
+WEATHER_TTL_JITTER = float(os.getenv("WEATHER_TTL_JITTER", "0.1"))
+# Most requested cities refreshed ahead of expiry, and how often to check
+WEATHER_REFRESH_TOP_N = int(os.getenv("WEATHER_REFRESH_TOP_N", "20"))
+WEATHER_REFRESH_SECONDS = float(os.getenv("WEATHER_REFRESH_SECONDS", "60"))
+# Cities and points kept in the weather cache
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1000"))
+# Upstream lookups one batch request may run at once
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "8"))
+
+
+class WeatherError(Exception):
+    """The weather for a location could not be fetched"""
+    def __init__(self, message, status_code=502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def location_name(location):
+    if isinstance(location, tuple):
+        return f"{location[0]:.4f},{location[1]:.4f}"
+    return location
+
+
+def _season_ranges(month):
+    """(temperature, humidity, rainfall) ranges of the Indian season of month"""
+    if month in [12, 1, 2]:  # Winter
+        return (15, 25), (50, 70), (0, 10)
+    elif month in [3, 4, 5]:  # Summer
+        return (25, 40), (40, 65), (0, 20)
+    elif month in [6, 7, 8, 9]:  # Monsoon
+        return (22, 32), (70, 90), (20, 80)
+    else:  # Post-monsoon
+        return (20, 30), (60, 80), (0, 30)
+
+
+class SimulatedWeatherProvider:
+    """Seasonal weather simulation used when no API key is configured"""
+    name = "simulated"
+
+    async def fetch(self, location):
+        temp_range, humidity_range, rainfall_range = _season_ranges(datetime.datetime.now().month)
+        return {
+            "city": location_name(location),
+            "temperature": random.randint(*temp_range),
+            "humidity": random.randint(*humidity_range),
+            "rainfall": random.randint(*rainfall_range),
+            "wind_speed": random.randint(5, 25),
+            "uv_index": random.randint(3, 11),
+            "soil_temperature": random.randint(temp_range[0] - 2, temp_range[1] + 2)
+        }
+
+    async def close(self):
+        pass
+
+
+class OpenWeatherProvider:
+    """OpenWeatherMap current weather over a pooled async HTTP client"""
+    name = "openweathermap"
+
+    def __init__(self, base_url=WEATHER_BASE_URL, api_key=WEATHER_API_KEY,
+                 timeout=WEATHER_TIMEOUT_SECONDS, retries=WEATHER_RETRIES,
+                 max_connections=WEATHER_MAX_CONNECTIONS, backoff=0.2, transport=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.retries = retries
+        self.backoff = backoff
+        self._timeout = httpx.Timeout(timeout, connect=min(timeout, 3.0))
+        self._limits = httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections)
+        self._transport = transport
+        self._client = None
+        self._loop = None
+
+    def _get_client(self):
+        # Its connections belong to one event loop; start a new pool on another
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, timeout=self._timeout, limits=self._limits,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def fetch(self, location):
+        params = {"appid": self.api_key, "units": "metric"}
+        if isinstance(location, tuple):
+            params["lat"], params["lon"] = location
+        else:
+            params["q"] = location
+        city = location_name(location)
+        failure = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.incr("weather_upstream_retries")
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = await self._get_client().get("/weather", params=params)
+            except httpx.TransportError as e:
+                failure = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                continue
+            except httpx.HTTPError as e:
+                # Not worth retrying: a bad encoding, a redirect loop, ...
+                raise WeatherError(f"Weather service request failed ({type(e).__name__})")
+            if response.status_code == 404:
+                raise WeatherError(f"Unknown location: {city}", status_code=404)
+            if response.status_code == 429 or response.status_code >= 500:
+                failure = f"HTTP {response.status_code}"
+                continue
+            if response.is_error:
+                raise WeatherError(f"Weather service rejected the request (HTTP {response.status_code})")
+            try:
+                return self._parse(city, response.json())
+            except (ValueError, AttributeError, TypeError, KeyError):
+                # Not JSON, or JSON of an unexpected shape
+                raise WeatherError("Weather service sent an unreadable response")
+        metrics.incr("weather_upstream_failures")
+        raise WeatherError(f"Weather service unavailable ({failure})", status_code=503)
+
+    @staticmethod
+    def _parse(city, body):
+        main = body.get("main", {})
+        rain = body.get("rain", {})
+        return {
+            "city": body.get("name") or city,
+            "temperature": round(main.get("temp", 0)),
+            "humidity": round(main.get("humidity", 0)),
+            "rainfall": round(rain.get("1h", rain.get("3h", 0))),
+            # m/s -> km/h, the unit the advisory rules use
+            "wind_speed": round(body.get("wind", {}).get("speed", 0) * 3.6),
+            # Not part of the current-weather response
+            "uv_index": None,
+            "soil_temperature": None
+        }
+
+    async def close(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+
+
+def default_provider():
+    """The provider chosen by WEATHER_PROVIDER and WEATHER_API_KEY"""
+    if WEATHER_PROVIDER == "simulated":
+        return SimulatedWeatherProvider()
+    if WEATHER_PROVIDER == "openweathermap" or WEATHER_API_KEY != "demo_key":
+        return OpenWeatherProvider()
+    return SimulatedWeatherProvider()
+
+
+class WeatherService:
+    """Cached, single-flight weather lookups with stale-while-revalidate.
+
+    The cache holds (stale_at, weather) entries. A fresh entry is served
+    as is; past stale_at it is still served at once while one background
+    task refreshes it, until the cache itself drops it (its own TTL, the
+    longest a reading may be served stale). stale_at is jittered per
+    entry, so cities cached together do not all go stale together.
+    """
+    def __init__(self, cache, provider=None, ttl=WEATHER_TTL_SECONDS, jitter=WEATHER_TTL_JITTER):
+        self.cache = cache
+        self.provider = provider or default_provider()
+        self.ttl = ttl
+        self.jitter = jitter
+        self._inflight = {}
+        # key -> requests since the refresher last looked, and the location asked for
+        self._requests = Counter()
+        self._locations = {}
+
+    @staticmethod
+    def key(location):
+        if isinstance(location, tuple):
+            # ~1 km cells, so nearby points share a reading
+            return f"{location[0]:.2f},{location[1]:.2f}"
+        return location.strip().lower()
+
+    def is_cached(self, location):
+        """Whether get(location) can answer without waiting on upstream"""
+        return self.cache.get(self.key(location)) is not None
+
+    def set_provider(self, provider):
+        """Swap the upstream (e.g. for a stub) and drop what the old one cached"""
+        self.provider = provider
+        self.cache.clear()
+
+    async def get(self, location):
+        """Weather for location from the cache, or from one shared upstream call"""
+        key = self.key(location)
+        self._requests[key] += 1
+        self._locations[key] = location
+        entry = self.cache.get(key)
+        if entry is not None:
+            stale_at, weather = entry
+            if time.monotonic() >= stale_at:
+                metrics.incr("weather_stale_served")
+                self.refresh(key, location)
+            else:
+                metrics.incr("weather_cache_hits")
+            return weather
+        task = self._inflight.get(key)
+        if task is None:
+            metrics.incr("weather_cache_misses")
+            task = self._start(key, location)
+        else:
+            metrics.incr("weather_coalesced")
+        # shield: a caller that goes away must not cancel the shared call
+        return await asyncio.shield(task)
+
+    async def get_many(self, locations, concurrency=WEATHER_BATCH_CONCURRENCY):
+        """Weather for each location, or the WeatherError it raised, in order.
+
+        Cached locations are answered at once; at most ``concurrency``
+        misses wait on upstream at the same time. Any other exception from
+        the provider is also returned as a WeatherError for that location,
+        so one bad lookup never fails the batch.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(location):
+            try:
+                if self.is_cached(location):
+                    return await self.get(location)
+                async with semaphore:
+                    return await self.get(location)
+            except WeatherError as e:
+                return e
+            except Exception as e:
+                print(f"⚠️ Weather lookup for {location_name(location)} failed: {e!r}")
+                return WeatherError(f"Weather lookup failed ({type(e).__name__})")
+
+        return await asyncio.gather(*(one(location) for location in locations))
+
+    def _start(self, key, location):
+        task = asyncio.ensure_future(self._load(key, location))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _load(self, key, location):
+        weather = await self.provider.fetch(location)
+        stale_at = time.monotonic() + self.ttl * random.uniform(1 - self.jitter, 1)
+        self.cache[key] = (stale_at, weather)
+        return weather
+
+    def refresh(self, key, location):
+        """Reload key in the background unless a load is already running"""
+        if key in self._inflight:
+            return
+        metrics.incr("weather_background_refreshes")
+        self._start(key, location).add_done_callback(self._refresh_done)
+
+    @staticmethod
+    def _refresh_done(task):
+        # Nobody awaits a background refresh; the stale entry stays served
+        if not task.cancelled() and task.exception() is not None:
+            metrics.incr("weather_refresh_failures")
+
+    def due_for_refresh(self, top_n, horizon):
+        """(key, location) of the top_n most requested going stale within horizon.
+
+        Request counts are halved on every call, so popularity follows
+        recent traffic and forgotten cities drop out.
+        """
+        now = time.monotonic()
+        due = []
+        for key, _ in self._requests.most_common(top_n):
+            entry = self.cache.get(key)
+            if entry is None or entry[0] <= now + horizon:
+                due.append((key, self._locations[key]))
+        for key in list(self._requests):
+            self._requests[key] //= 2
+            if not self._requests[key]:
+                del self._requests[key]
+                self._locations.pop(key, None)
+        return due
+
+    async def run_refresher(self, top_n=WEATHER_REFRESH_TOP_N, interval=WEATHER_REFRESH_SECONDS,
+                            jitter=WEATHER_TTL_JITTER):
+        """Refresh popular cities before they go stale; run as a background task.
+
+        Cycles start at jittered times, so workers do not refresh in
+        lockstep, and a cycle's refreshes are spread over part of the
+        interval instead of hitting upstream as one burst.
+        """
+        while True:
+            await asyncio.sleep(interval * random.uniform(1 - jitter, 1 + jitter))
+            try:
+                due = self.due_for_refresh(top_n, horizon=2 * interval)
+                spacing = interval / 2 / max(len(due), 1)
+                for key, location in due:
+                    self.refresh(key, location)
+                    await asyncio.sleep(spacing * random.uniform(0.5, 1.5))
+            except Exception as e:
+                print(f"⚠️ Weather refresh failed: {e}")
+
+    async def close(self):
+        await self.provider.close()
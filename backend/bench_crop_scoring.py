@@ -0,0 +1,63 @@
+"""Crop health scoring for a cooperative's plots: one request per field
+versus one /predict/batch request for all of them, and the cost of
+ranking crops for one field from the precomputed score tensor.
+
+Runs in-process through FastAPI's TestClient, so the numbers include
+request parsing and JSON serialization but no network.
+
+Run from the backend directory:  python bench_crop_scoring.py [fields]
+"""
+import random
+import sys
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from app.routes.advisory import crop_factor_tables
+
+CROPS = ["wheat", "rice", "corn", "tomato", "millet"]
+SEASONS = ["winter", "summer", "monsoon"]
+SOILS = ["loamy", "clay", "sandy"]
+
+
+def random_fields(count):
+    return [
+        {
+            "field_id": f"plot-{i}",
+            "crop": random.choice(CROPS),
+            "season": random.choice(SEASONS),
+            "soil_type": random.choice(SOILS),
+        }
+        for i in range(count)
+    ]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    fields = random_fields(count)
+    client = TestClient(main.app)
+    print(f"🌱 Crop health for {count} fields")
+    print("=" * 50)
+
+    sample = fields[:min(count, 500)]
+    started = time.perf_counter()
+    for field in sample:
+        client.post("/api/advisory/predict", params={
+            "crop": field["crop"], "season": field["season"], "soil_type": field["soil_type"],
+        })
+    per_field = (time.perf_counter() - started) / len(sample)
+    print(f"  one request per field   {per_field * count * 1000:>9.0f} ms  "
+          f"(extrapolated from {len(sample)})")
+
+    started = time.perf_counter()
+    body = client.post("/api/advisory/predict/batch", json={"fields": fields}).json()
+    elapsed = time.perf_counter() - started
+    print(f"  one batch request       {elapsed * 1000:>9.0f} ms  "
+          f"{body['summary']['advice_classes']} advice texts rendered")
+
+    rounds = 100000
+    started = time.perf_counter()
+    for i in range(rounds):
+        crop_factor_tables.get().top_crops(SEASONS[i % 3], SOILS[i % 3], 3)
+    print(f"\n🏆 Top-3 crop ranking: {(time.perf_counter() - started) / rounds * 1e6:.1f} µs per field")
@@ -0,0 +1,107 @@
+"""Checkout throughput and oversell rate for one hot listing.
+
+Many buyers race for a product with limited stock. The naive checkout reads
+the quantity and writes it back; the reservation path takes stock with one
+atomic guarded decrement. Oversold kg = kg sold beyond the stock there was.
+
+Run from the backend directory:  python bench_inventory.py [stock] [buyers]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from app.database import COLLECTION_INDEXES
+from app.sqlite_database import SQLiteDatabase
+from app.utils.inventory import DatabaseStock, MemoryStock
+
+PRODUCT_ID = 1
+THREADS = 16
+
+
+def report(label, stock, sold, seconds):
+    oversold = max(0, sold - stock)
+    print(f"  {label:<34} {sold / seconds:>10.0f} orders/sec  "
+          f"sold {sold:>6}/{stock} kg  oversold {oversold / stock:>6.1%}")
+
+
+def run_threads(checkout, attempts):
+    sold = []
+    per_thread = attempts // THREADS
+
+    def buyer():
+        count = 0
+        for _ in range(per_thread):
+            if checkout():
+                count += 1
+        sold.append(count)
+
+    threads = [threading.Thread(target=buyer) for _ in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(sold), time.perf_counter() - started
+
+
+def bench_memory(stock, attempts):
+    print(f"\n🧵 In-process stock, {THREADS} threads")
+    listing = {"id": PRODUCT_ID, "quantity_kg": stock}
+
+    def naive():
+        quantity = listing["quantity_kg"]
+        if quantity < 1:
+            return False
+        time.sleep(0)  # any await or I/O between the read and the write
+        listing["quantity_kg"] = quantity - 1
+        return True
+
+    sold, seconds = run_threads(naive, attempts)
+    report("read-then-write", stock, sold, seconds)
+
+    listing["quantity_kg"] = stock
+    guarded = MemoryStock(lambda product_id: listing)
+    sold, seconds = run_threads(lambda: guarded.take_sync(PRODUCT_ID, 1), attempts)
+    report("striped lock (MemoryStock)", stock, sold, seconds)
+
+
+async def bench_database(stock, attempts):
+    print("\n💾 Shared SQLite stock collection, 2 workers")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "inventory.db")
+        workers = [SQLiteDatabase(path, indexes=COLLECTION_INDEXES) for _ in range(2)]
+        try:
+            await workers[0]["stock"].insert_one({"id": PRODUCT_ID, "quantity_kg": stock})
+
+            async def naive(db):
+                doc = await db["stock"].find_one({"id": PRODUCT_ID})
+                if doc["quantity_kg"] < 1:
+                    return False
+                await db["stock"].update_one({"id": PRODUCT_ID}, {"$set": {"quantity_kg": doc["quantity_kg"] - 1}})
+                return True
+
+            stores = [DatabaseStock(db["stock"], lambda product_id: None, db["reservations"]) for db in workers]
+
+            for label, checkout in (
+                ("read-then-write", lambda i: naive(workers[i % 2])),
+                ("guarded $inc (DatabaseStock)", lambda i: stores[i % 2].take(PRODUCT_ID, 1)),
+            ):
+                await workers[0]["stock"].update_one({"id": PRODUCT_ID}, {"$set": {"quantity_kg": stock}})
+                started = time.perf_counter()
+                results = await asyncio.gather(*(checkout(i) for i in range(attempts)))
+                report(label, stock, sum(results), time.perf_counter() - started)
+        finally:
+            for db in workers:
+                db.close()
+
+
+if __name__ == "__main__":
+    stock = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    buyers = int(sys.argv[2]) if len(sys.argv) > 2 else 2 * stock
+    print(f"🛒 {buyers} checkouts of 1 kg against {stock} kg of stock")
+    print("=" * 50)
+    bench_memory(stock, buyers)
+    asyncio.run(bench_database(stock, buyers))
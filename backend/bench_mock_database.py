@@ -0,0 +1,54 @@
+"""Insert-throughput benchmark for the fallback (no MongoDB) user store.
+
+Run from the backend directory:  python bench_mock_database.py [users]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from app.database import MockCollection
+
+
+async def bench_inserts(total_users):
+    with tempfile.TemporaryDirectory() as tmp:
+        collection = MockCollection(path=os.path.join(tmp, "mock_users.json"))
+        checkpoint = max(1, total_users // 5)
+        start = time.perf_counter()
+        window_start = start
+        for i in range(total_users):
+            await collection.insert_one({
+                "username": f"farmer{i}",
+                "email": f"farmer{i}@example.com",
+                "full_name": f"Farmer {i}",
+                "user_type": "farmer",
+                "is_active": True,
+            })
+            if (i + 1) % checkpoint == 0:
+                now = time.perf_counter()
+                print(f"  {i + 1:>8} users  {checkpoint / (now - window_start):>10.0f} inserts/sec")
+                window_start = now
+        collection._store.close()
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reloaded = MockCollection(path=os.path.join(tmp, "mock_users.json"))
+        reload_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(0, total_users, 7):
+            await reloaded.find_one({"username": f"farmer{i}"})
+        lookups = len(range(0, total_users, 7))
+        lookup_time = time.perf_counter() - start
+
+    print(f"\n📊 {total_users} inserts in {elapsed:.2f}s ({total_users / elapsed:.0f} inserts/sec sustained)")
+    print(f"🔁 Recovered {len(reloaded._data)} users on reload in {reload_time:.2f}s")
+    print(f"🔍 {lookups / lookup_time:.0f} indexed find_one/sec")
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"🌾 Mock database insert benchmark ({users} users)")
+    print("=" * 50)
+    asyncio.run(bench_inserts(users))
@@ -0,0 +1,33 @@
+"""Login throughput per CPU core at each bcrypt cost.
+
+Run from the backend directory:  python bench_password_hashing.py [min] [max]
+"""
+import sys
+import time
+
+from passlib.context import CryptContext
+
+from app.utils.auth import calibrate_bcrypt_rounds
+
+
+def logins_per_second(rounds, samples):
+    context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+    stored = context.hash("correct horse battery staple")
+    started = time.perf_counter()
+    for _ in range(samples):
+        context.verify("correct horse battery staple", stored)
+    per_login = (time.perf_counter() - started) / samples
+    return per_login, 1 / per_login
+
+
+if __name__ == "__main__":
+    low = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    high = int(sys.argv[2]) if len(sys.argv) > 2 else 14
+    print("🔑 bcrypt cost benchmark (single thread = one core)")
+    print("=" * 50)
+    for rounds in range(low, high + 1):
+        # Fewer samples at high cost so the run stays short
+        samples = max(2, 2 ** (14 - rounds))
+        per_login, rate = logins_per_second(rounds, samples)
+        print(f"  cost {rounds:>2}: {per_login * 1000:>8.1f} ms/login  {rate:>8.1f} logins/sec/core")
+    print(f"\n🎯 Calibration picks cost {calibrate_bcrypt_rounds()} for this machine")
@@ -0,0 +1,169 @@
+"""Weather lookups against a local stub of the OpenWeatherMap API.
+
+The stub answers /weather after a fixed delay and counts the calls it
+gets, so the numbers show how many upstream calls a burst of advisory
+requests costs and how long callers wait, without touching the real API.
+
+Then a 40-city dashboard is fetched one city at a time and as one batch.
+The last part replays steady traffic for a few seconds with a short
+TTL and reports request latency percentiles with and without
+stale-while-revalidate.
+
+Run from the backend directory:  python bench_weather.py [requests] [cities]
+"""
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cachetools import TTLCache
+
+from app.utils.weather import OpenWeatherProvider, WeatherService
+
+UPSTREAM_DELAY_SECONDS = 0.1
+
+
+class StubWeatherServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=UPSTREAM_DELAY_SECONDS):
+        super().__init__(("127.0.0.1", 0), StubWeatherHandler)
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        pass  # clients hanging up when the benchmark ends
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.calls += 1
+        time.sleep(self.server.delay)
+        query = parse_qs(urlparse(self.path).query)
+        city = query.get("q", [""])[0]
+        if city.startswith("Unknown"):
+            self.send_error(404)
+            return
+        body = json.dumps({
+            "name": city,
+            "main": {"temp": 31.4, "humidity": 62},
+            "wind": {"speed": 4.2},
+            "rain": {"1h": 3.0},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def max_loop_lag(stop):
+    """Worst delay of a 10 ms ticker; large values mean the loop was blocked"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        worst = max(worst, time.perf_counter() - started - 0.01)
+    return worst
+
+
+async def burst(server, label, lookup, requests, cities):
+    server.calls = 0
+    stop = asyncio.Event()
+    lag = asyncio.ensure_future(max_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(lookup(f"City{i % cities}") for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    print(f"  {label:<28} {server.calls:>5} upstream calls  {elapsed * 1000:>8.0f} ms  "
+          f"loop lag {await lag * 1000:>5.1f} ms")
+
+
+async def steady_traffic(server, label, service, cities, refresher, seconds=3.0, ttl=0.5):
+    """Requests every 2 ms, skewed to a few popular cities, for seconds"""
+    weights = [1 / (rank + 1) for rank in range(cities)]
+    await asyncio.gather(*(service.get(f"City{i}") for i in range(cities)))
+    server.calls = 0
+    latencies = []
+
+    async def one(city):
+        started = time.perf_counter()
+        await service.get(city)
+        latencies.append(time.perf_counter() - started)
+
+    if refresher:
+        refresher = asyncio.ensure_future(service.run_refresher(top_n=3, interval=ttl / 2))
+    pending = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        city = f"City{random.choices(range(cities), weights)[0]}"
+        pending.append(asyncio.ensure_future(one(city)))
+        await asyncio.sleep(0.002)
+    await asyncio.gather(*pending)
+    if refresher:
+        refresher.cancel()
+    await asyncio.sleep(2 * UPSTREAM_DELAY_SECONDS)  # let background refreshes land
+    latencies.sort()
+    p50, p99 = (latencies[int(q * (len(latencies) - 1))] * 1000 for q in (0.5, 0.99))
+    print(f"  {label:<28} {server.calls:>5} upstream calls  p50 {p50:>6.1f} ms  "
+          f"p99 {p99:>6.1f} ms  max {latencies[-1] * 1000:>6.1f} ms")
+
+
+async def main(requests, cities):
+    server = StubWeatherServer().start()
+    provider = OpenWeatherProvider(base_url=server.url, api_key="stub")
+    try:
+        print(f"🌦️ {requests} concurrent lookups over {cities} cities, "
+              f"upstream answers in {UPSTREAM_DELAY_SECONDS * 1000:.0f} ms")
+        print("=" * 50)
+        await burst(server, "provider, no cache", provider.fetch, requests, cities)
+        service = WeatherService(TTLCache(maxsize=100, ttl=300), provider)
+        await burst(server, "service, cold cache", service.get, requests, cities)
+        await burst(server, "service, warm cache", service.get, requests, cities)
+
+        print("\n🗺️ Dashboard of 40 uncached cities")
+        print("=" * 50)
+        for label, concurrency in (("one at a time", 1), ("batch, 8 concurrent misses", 8)):
+            batch = WeatherService(TTLCache(maxsize=100, ttl=300), provider)
+            server.calls = 0
+            started = time.perf_counter()
+            await batch.get_many([f"District{i}" for i in range(40)], concurrency=concurrency)
+            print(f"  {label:<28} {server.calls:>5} upstream calls  "
+                  f"{(time.perf_counter() - started) * 1000:>8.0f} ms")
+
+        print(f"\n⏱️ Steady traffic, {cities} cities, readings fresh for 0.5 s")
+        print("=" * 50)
+        expiring = WeatherService(TTLCache(maxsize=100, ttl=0.5), provider, ttl=0.5, jitter=0)
+        await steady_traffic(server, "expire and refetch", expiring, cities, refresher=False)
+        revalidating = WeatherService(TTLCache(maxsize=100, ttl=30), provider, ttl=0.5)
+        await steady_traffic(server, "stale-while-revalidate", revalidating, cities, refresher=False)
+        revalidating = WeatherService(TTLCache(maxsize=100, ttl=30), provider, ttl=0.5)
+        await steady_traffic(server, "  + top-3 refresher", revalidating, cities, refresher=True)
+    finally:
+        await provider.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    cities = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(main(requests, cities))
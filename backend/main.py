@@ -3,7 +3,10 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.routes import auth, farmers, marketplace, advisory, admin, location
 from app.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils import metrics
+from app.utils.auth import configure_password_hashing
 from datetime import datetime
+import asyncio
 import os
 
 app = FastAPI(title="Krishi API", version="1.0.0", description="AI-Powered Agricultural Intelligence Platform")
@@ -14,6 +17,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
@@ -21,13 +25,21 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     print("🌾 Starting Krishi API...")
+    configure_password_hashing()
     await connect_to_mongo()
+    app.state.reservation_sweeper = asyncio.create_task(marketplace.reservations.run_sweeper())
+    app.state.weather_refresher = asyncio.create_task(advisory.weather.run_refresher())
     print("✅ Krishi API started successfully!")
     print("🌐 Server running at: http://localhost:8001")
     print("📚 API docs at: http://localhost:8001/docs")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    for name in ("reservation_sweeper", "weather_refresher"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    await advisory.weather.close()
     await close_mongo_connection()
 
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
@@ -67,6 +79,11 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process counters and timings for this worker"""
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001, reload=True)
\ No newline at end of file
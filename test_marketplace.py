@@ -35,6 +35,21 @@ def test_image_urls():
     else:
         print(f"\n🎉 All {len(MOCK_PRODUCTS)} product images are accessible!")
 
+def test_short_search_words_match_substrings():
+    """One- and two-letter searches match like the plain substring filter did"""
+    from backend.app.utils.search import TextIndex
+
+    index = TextIndex()
+    for product in MOCK_PRODUCTS:
+        index.add(product['id'], product)
+    for query in ("ri", "to", "a"):
+        expected = {
+            p['id'] for p in MOCK_PRODUCTS
+            if query in p['name'].lower() or query in p['description'].lower()
+        }
+        assert expected, query
+        assert set(index.search(query)) == expected, query
+
 def print_product_summary():
     """Print summary of products by category"""
     print("\n📊 Product Summary:")